@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""benchmark the device_to_xlsx export
+
+Writes synthetic devices using the columns of
+playbooks/export_device.yaml.example, once as one workbook per device
+(filename) and once as one workbook with a sheet per device (workbook).
+
+usage: python benchmarks/export_device_to_xlsx.py [--devices 1000] [--interfaces 24]
+"""
+
+import argparse
+import os
+import sys
+import time
+import shutil
+import tempfile
+import yaml
+from loguru import logger
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASEDIR)
+import exporter
+
+
+def get_device(i, number_of_interfaces):
+    interfaces = [{'name': f'GigabitEthernet1/0/{j}',
+                   'mode': 'access',
+                   'status': {'name': 'Active'},
+                   'type': '1000base-t',
+                   'ip_addresses': [{'address': f'10.{i % 256}.{j}.1/24'}] if j < 2 else [],
+                   'description': f'port {j}',
+                   'untagged_vlan': {'vid': 10},
+                   'tagged_vlans': [{'vid': 20}, {'vid': 30}]} for j in range(number_of_interfaces)]
+    return {'name': f'device-{i}.local',
+            'role': {'name': 'access'},
+            'device_type': {'model': 'C9300'},
+            'serial': f'SN{i:08d}',
+            'location': {'name': 'site1', 'location_type': {'name': 'site'}},
+            'status': {'name': 'Active'},
+            'platform': {'name': 'ios'},
+            'primary_ip4': {'interfaces': [{'name': 'Vlan1'}]},
+            'custom_fields': {'net': 'lab', 'snmp_credentials': 'v3'},
+            'tags': [{'name': 'access'}, {'name': 'lab'}],
+            'vrfs': [{'name': 'mgmt', 'namespace': {'name': 'Global'}}],
+            'interfaces': interfaces}
+
+def get_size(directory):
+    files = [os.path.join(root, f) for root, _, filenames in os.walk(directory) for f in filenames]
+    return len(files), sum(os.path.getsize(f) for f in files)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=1000, help='number of devices')
+    parser.add_argument('--interfaces', type=int, default=24, help='number of interfaces of each device')
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    with open(os.path.join(BASEDIR, 'playbooks', 'export_device.yaml.example')) as f:
+        playbook = yaml.safe_load(f)
+    task = playbook['jobs'][0]['tasks'][0]['export'][0]
+    devices = [get_device(i, args.interfaces) for i in range(args.devices)]
+
+    directory = tempfile.mkdtemp(prefix='kobold_benchmark_')
+    try:
+        modes = {'filename': dict(task, filename=f'{directory}/filename/__name__.xlsx'),
+                 'workbook': dict(task, workbook=f'{directory}/workbook/devices.xlsx')}
+        print(f'{args.devices} devices with {args.interfaces} interfaces each')
+        print(f'{"mode":<10} {"time (s)":>9} {"files":>6} {"size (MB)":>10}')
+        for mode, mode_task in modes.items():
+            started = time.perf_counter()
+            exporter.export_device_to_xlsx(None, None, mode_task, devices)
+            duration = time.perf_counter() - started
+            number_of_files, size = get_size(f'{directory}/{mode}')
+            print(f'{mode:<10} {duration:>9.1f} {number_of_files:>6} {size / 1e6:>10.1f}')
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""benchmark the export of device properties
+
+Exports the properties of synthetic devices as CSV and as EXCEL
+(xlsxwriter in constant memory mode). The devices are generated while
+they are exported, the same way the pages of a PagedSelect are read,
+so the peak memory is the memory used by the export itself. It must not
+grow with the number of devices.
+
+usage: python benchmarks/export_properties.py [--devices 1000 10000] [--interfaces 8]
+"""
+
+import argparse
+import os
+import sys
+import time
+import shutil
+import tempfile
+import tracemalloc
+from loguru import logger
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import exporter
+
+
+COLUMNS = 'id, name, primary_ip4.address, interfaces.name, interfaces.description, checksum'
+
+def get_devices(number_of_devices, number_of_interfaces):
+    for i in range(number_of_devices):
+        yield {'id': f'{i:08x}-0000-0000-0000-000000000000',
+               'name': f'device-{i}.local',
+               'primary_ip4': {'address': f'10.{i // 65536}.{i // 256 % 256}.{i % 256}/32'},
+               'interfaces': [{'name': f'GigabitEthernet1/0/{j}', 'description': f'port {j} of device {i}'}
+                              for j in range(number_of_interfaces)]}
+
+def export(task, number_of_devices, number_of_interfaces):
+    exporter.export_device_properties(None, None, task, get_devices(number_of_devices, number_of_interfaces))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, nargs='*', default=[1000, 10000], help='number of devices')
+    parser.add_argument('--interfaces', type=int, default=8, help='number of interfaces (rows) of each device')
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    directory = tempfile.mkdtemp(prefix='kobold_benchmark_')
+    try:
+        print(f'{"format":<7} {"devices":>8} {"rows":>8} {"time (s)":>9} {"peak memory (MB)":>17} {"size (MB)":>10}')
+        for file_format in ('csv', 'xlsx'):
+            task = {'header': True,
+                    'columns': COLUMNS,
+                    'format': file_format,
+                    'filename': f'{directory}/properties.{file_format}'}
+            for number_of_devices in args.devices:
+                started = time.perf_counter()
+                export(task, number_of_devices, args.interfaces)
+                duration = time.perf_counter() - started
+
+                # the memory is measured by a second run; tracemalloc slows it down
+                tracemalloc.start()
+                export(task, number_of_devices, args.interfaces)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                size = os.path.getsize(task['filename'])
+                print(f'{file_format:<7} {number_of_devices:>8} {number_of_devices * args.interfaces:>8} '
+                      f'{duration:>9.2f} {peak / 1e6:>17.2f} {size / 1e6:>10.1f}')
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
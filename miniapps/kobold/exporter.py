@@ -1,12 +1,19 @@
 import os
 import json
 import csv
-import pandas as pd
 import re
+import time
+import itertools
+from collections import deque
+import xlsxwriter
+import warnings
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from loguru import logger
 from dotenv import load_dotenv
 from openpyxl import Workbook
-from openpyxl.worksheet.table import Table, TableStyleInfo
+from openpyxl.worksheet.table import Table, TableStyleInfo, TableColumn
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
 from openpyxl.styles import PatternFill, Font
 from benedict import benedict
 
@@ -135,13 +142,13 @@ def get_device_config_and_facts(sot, playbook, device_properties):
 
     return device_config, device_facts
 
-def export_config_and_facts(sot, playbook, task, device_properties):
+def get_hostname(device_properties):
+    return device_properties.get('hostname', device_properties.get('name'))
 
-    hostname = device_properties.get('hostname')
-    logger.debug(f'getting config and facts from {hostname}')
-    device_config, device_facts = get_device_config_and_facts(sot, playbook, device_properties)
+def write_config_and_facts(task, hostname, device_config, device_facts):
     content = task.get('content')
     BASEDIR = os.path.abspath(os.path.dirname(__file__))
+    status, message = 'ok', None
 
     if 'config' in content:
         filename = "%s/%s/%s.conf" % (
@@ -151,7 +158,8 @@ def export_config_and_facts(sot, playbook, task, device_properties):
         subdir = os.path.dirname(filename)
         if not os.path.exists(subdir):
                 logger.info(f'creating missing directory {subdir}')
-                os.makedirs(subdir)
+                # other workers may create the directory at the same time
+                os.makedirs(subdir, exist_ok=True)
 
         logger.info(f'writing config to {filename}')
         try:
@@ -159,9 +167,9 @@ def export_config_and_facts(sot, playbook, task, device_properties):
                 f.write(device_config)
         except Exception as exc:
             logger.error(f'could not write config; got exception {exc}')
+            status, message = 'failed', f'could not write config; got exception {exc}'
 
     if 'facts' in content:
-        hostname = device_properties.get('hostname')
         filename = "%s/%s/%s.facts" % (
             BASEDIR, 
             task.get('directory','./configs'), 
@@ -169,7 +177,7 @@ def export_config_and_facts(sot, playbook, task, device_properties):
         subdir = os.path.dirname(filename)
         if not os.path.exists(subdir):
                 logger.info(f'creating missing directory {subdir}')
-                os.makedirs(subdir)
+                os.makedirs(subdir, exist_ok=True)
 
         logger.info(f'writing facts to {filename}')
         try:
@@ -177,325 +185,556 @@ def export_config_and_facts(sot, playbook, task, device_properties):
                 f.write(json.dumps(device_facts,indent=4))
         except Exception as exc:
             logger.error(f'could not write facts; got exception {exc}')
+            status, message = 'failed', f'could not write facts; got exception {exc}'
+
+    return status, message
+
+def export_all_config_and_facts(sot, playbook, task, devices):
+    """get config and facts of all devices concurrently
+
+    The devices are processed by a pool of num_workers threads (one SSH
+    session per thread). If timeout is set, a device that has not sent
+    its config and facts within timeout seconds is reported as timed out
+    and its result is dropped. A device that fails does not stop the
+    export; all failures are reported when the export is done.
+    """
+    devices = list(devices)
+    num_workers = task.get('num_workers', 8)
+    timeout = task.get('timeout')
+    # index of device -> start time of the collection
+    started = {}
+    # index of devices that timed out; their results are not written
+    abandoned = set()
+
+    def collect(index, device_properties):
+        hostname = get_hostname(device_properties)
+        started[index] = time.monotonic()
+        try:
+            device_config, device_facts = get_device_config_and_facts(sot, playbook, device_properties)
+        except Exception as exc:
+            logger.error(f'could not get config and facts of {hostname}; got exception {exc}')
+            return 'failed', f'got exception {exc}'
+        if device_config is None or device_facts is None:
+            return 'failed', 'could not get config and facts'
+        if index in abandoned:
+            return 'timeout', f'no result after {timeout}s'
+        return write_config_and_facts(task, hostname, device_config, device_facts)
+
+    logger.info(f'getting config and facts of {len(devices)} devices using {num_workers} workers')
+    executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='collector')
+    futures = {executor.submit(collect, index, device): index for index, device in enumerate(devices)}
+    # index of device -> (status, message)
+    results = {}
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=1 if timeout else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[futures[future]] = future.result()
+            if not timeout:
+                continue
+            now = time.monotonic()
+            for future in list(pending):
+                index = futures[future]
+                if index in started and now - started[index] > timeout:
+                    # the thread cannot be stopped; it is left to the timeouts of the SSH connection
+                    logger.error(f'{get_hostname(devices[index])} sent no config and facts within {timeout}s')
+                    abandoned.add(index)
+                    pending.discard(future)
+                    results[index] = ('timeout', f'no result after {timeout}s')
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    report = [{'name': get_hostname(devices[index]), 'status': status, 'message': message}
+              for index, (status, message) in sorted(results.items())]
+    write_collection_report(task, report)
+    return report
+
+def write_collection_report(task, report):
+    failed = [r for r in report if r['status'] != 'ok']
+    logger.info(f'got config and facts of {len(report) - len(failed)} devices; {len(failed)} failed')
+    for result in failed:
+        logger.error(f'{result["name"]}: {result["status"]} {result["message"]}')
+
+    filename = task.get('report')
+    if not filename:
+        return
+    directory = os.path.dirname(filename)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    logger.info(f'writing report to {filename}')
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'status', 'message'])
+        for result in report:
+            writer.writerow([result['name'], result['status'], result['message'] or ''])
+
+def get_hldm(sot, device):
+    hostname = device.get('name')
+    logger.debug(f'exporting HLDM of {hostname}')
+    try:
+        return sot.get.hldm(device=hostname, get_id=False)[0]
+    except Exception as exc:
+        logger.error(f'could not get HLDM of {hostname}; got exception {exc}')
+        return None
 
 def export_hldm(sot, playbook, task, devices):
+    """export the HLDM of all devices
+
+    The HLDM of each device is one GraphQL query; the queries are sent by
+    a pool of num_workers threads. At most queue_size devices are queued,
+    so the devices can be read page by page. Each HLDM is written as soon
+    as it is received, either to its own file or, if jsonl is set, as one
+    line of a single JSONL file.
+    """
     filename_pattern = task.get('filename', '__name__')
     subdir_pattern = task.get('directory', '')
-
-    for device in devices:
-        hostname = device.get('name')
-        logger.debug(f'exporting HLDM of {hostname}')
-        hldm = sot.get.hldm(device=hostname, get_id=False)[0]
+    num_workers = task.get('num_workers', 8)
+    queue_size = max(task.get('queue_size', 100), num_workers)
+    jsonl = task.get('jsonl')
+
+    jsonl_file = None
+    if jsonl:
+        directory = os.path.dirname(jsonl)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        logger.info(f'writing HLDM to {jsonl}')
+        jsonl_file = open(jsonl, 'w')
+
+    created = set()
+    def write(hldm):
+        if jsonl_file:
+            jsonl_file.write(json.dumps(hldm) + '\n')
+            return
         subdir = playbook.pattern_to_filename(subdir_pattern, hldm)
         filename = playbook.pattern_to_filename(filename_pattern, hldm)
 
         logger.debug(f'writing HLDM to subdir {subdir} filename {filename}')
-        if not os.path.exists(subdir):
+        if subdir not in created:
+            if not os.path.exists(subdir):
                 logger.info(f'creating missing directory {subdir}')
                 os.makedirs(subdir)
+            created.add(subdir)
         with open(f'{subdir}/{filename}', "w") as f:
             f.write(json.dumps(hldm, indent=4))
 
+    # the HLDM are written in the order of the devices
+    results = {'exported': 0, 'failed': 0}
+    def write_next(queue):
+        hldm = queue.popleft().result()
+        if hldm is None:
+            results['failed'] += 1
+        else:
+            write(hldm)
+            results['exported'] += 1
+
+    queue = deque()
+    executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='hldm')
+    try:
+        for device in devices:
+            queue.append(executor.submit(get_hldm, sot, device))
+            if len(queue) >= queue_size:
+                write_next(queue)
+        while queue:
+            write_next(queue)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if jsonl_file:
+            jsonl_file.close()
+    logger.info(f'exported HLDM of {results["exported"]} devices; {results["failed"]} failed')
+
 #
 # device properties
 #
 
-def export_device_properties_as_csv(task, data_to_export):
-    logger.info(f'exporting {len(data_to_export)} entries as CSV')
-
+def export_device_properties_as_csv(task, rows):
+    """write rows to a CSV file row by row"""
     separator = task.get('separator',',')
-    quotechar = task.get('quotechar')
+    quotechar = task.get('quotechar') or '"'
 
     # quoting : int, Controls whether quotes should be recognized. 
     # Values are taken from csv.QUOTE_* values. Acceptable values are 0, 1, 2, and 3 for 
     # QUOTE_MINIMAL, QUOTE_ALL, QUOTE_NONE, and QUOTE_NONNUMERIC,
     # respectively.
     quoting_txt = task.get('quoting','minimal')
-    if quoting_txt.lower() == "minimal":
-        quoting = csv.QUOTE_MINIMAL
-    elif quoting_txt.lower() == "all":
+    if quoting_txt.lower() == "all":
         quoting = csv.QUOTE_ALL
     elif quoting_txt.lower() == "none":
         quoting = csv.QUOTE_NONE
     elif quoting_txt.lower() == "nonnummeric":
         quoting = csv.QUOTE_NONNUMERIC
+    else:
+        quoting = csv.QUOTE_MINIMAL
 
     filename = task.get('filename','export.csv')
     # create directory if it does not exsists
     directory = os.path.dirname(filename)
-    if not os.path.exists(directory):
+    if directory and not os.path.exists(directory):
         os.makedirs(directory)
 
-    # reformat data_to_export
-    data = reformat_data(data_to_export)
-    df = pd.DataFrame(data)
-
     logger.info(f'exporting data to {filename}')
-    df.to_csv(filename, sep=separator, index=False, quoting=quoting, quotechar=quotechar)
-
-def reformat_data(originate_data):
-    # reformat data_to_export
-    # we need a list of dicts
-    # data_to_export is a list of lists to write the data with csv easily
-    data = {}
-    rows = len(originate_data)
-    cols = len(originate_data[0])
-    logger.debug(f'the data have {rows} rows and {cols} cols')
-    for i in range(0, cols):
-        key = originate_data[0][i]
-        data[key] = []
-        for n in range(1, rows):
-            logger.bind(extra='reformat').debug(f'key={key} val={originate_data[n][i]}')
-            data[key].append(originate_data[n][i])
-    return data
-
-def export_device_properties_as_xlsxl(task, data_to_export):
+    number_of_rows = 0
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter=separator, quoting=quoting, quotechar=quotechar, lineterminator='\n')
+        for row in rows:
+            writer.writerow(row)
+            number_of_rows += 1
+    logger.info(f'exported {number_of_rows} entries as CSV')
+
+def get_xlsx_value(value):
+    # the cells of a worksheet contain scalars only
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+def export_device_properties_as_xlsxl(task, rows):
+    """write rows to an EXCEL file row by row
+
+    The workbook is written in constant memory mode, so each row is
+    flushed to disk when the next row is written. Excel tables are not
+    available in this mode; the header is formatted and gets an
+    autofilter instead.
+    """
     filename = task.get('filename','export.xlsx')
     logger.bind(extra='exp properties').info(f'exporting data as EXCEL to {filename}')
 
-    # reformat data_to_export
-    data = reformat_data(data_to_export)
-
     # create directory if it does not exsists
     directory = os.path.dirname(filename)
-    if not os.path.exists(directory):
+    if directory and not os.path.exists(directory):
         os.makedirs(directory)
 
-    df = pd.DataFrame(data)
-
-    writer = pd.ExcelWriter(filename, engine='xlsxwriter')
-    df.to_excel(writer, sheet_name='Properties', startrow=1, header=False, index=False)
-
-    # Get the xlsxwriter workbook and worksheet objects.
-    worksheet = writer.sheets["Properties"]
-
-    # Get the dimensions of the dataframe.
-    (max_row, max_col) = df.shape
-
-    # Create a list of column headers, to use in add_table().
-    column_settings = [{"header": column} for column in df.columns]
-
-    # Add the Excel table structure. Pandas will add the data.
-    worksheet.add_table(0, 0, max_row, max_col - 1, {"columns": column_settings})
+    workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Properties')
+    header_format = workbook.add_format({'bold': True, 'font_color': '#FFFFFF', 'bg_color': '#4F81BD'})
 
+    # the first row is the header
+    header = next(rows)
+    max_col = len(header)
     # Make the columns wider for clarity.
     worksheet.set_column(0, max_col - 1, 12)
-    writer.close()
-
-def get_device_data_to_export(sot, task, devices):
-
+    worksheet.freeze_panes(1, 0)
+    worksheet.write_row(0, 0, header, header_format)
+    max_row = 0
+    for max_row, row in enumerate(rows, start=1):
+        worksheet.write_row(max_row, 0, [get_xlsx_value(value) for value in row])
+    worksheet.autofilter(0, 0, max_row, max_col - 1)
+    workbook.close()
+    logger.info(f'exported {max_row} entries as EXCEL')
+
+def get_cell(value, n):
+    """return the value of row n of a column"""
+    if isinstance(value, str):
+        return value
+    if value is None:
+        return 'null'
+    dta = value[n]
+    if isinstance(dta, list):
+        return dta[0] if len(dta) > 0 else ""
+    return dta
+
+def iter_device_data_to_export(task, devices):
     """
-    prepare data to export by scanning through ALL devices and build table
+    yield the rows to export by scanning through ALL devices
+
+    The first row is the header if the user wants one. Rows are yielded
+    as soon as a device is processed, so the table is never kept in
+    memory. This loop runs once per device and column, so we do not log
+    single values here.
     """
 
-    # our list of dicts that contains the data we export
-    data_to_export = []
-    # some defaults
-    calculate_checksum = False
     header_written = False
 
     # columns is the list of device/interface properties the user wants to export
     columns = task.get('columns').replace(' ','').split(',')
+    keys = [column.split('.') for column in columns]
+    # the last column is the MD5 sum of the row if any column is a checksum
+    calculate_checksum = any('checksum' in column for column in columns)
 
     for device in devices:
-        device_property = {}
-        for column in columns:
-            data = get_value(device, column.split('.'))
-            logger.debug(f'column={column} data={data}')
-            device_property[column] = data
-        
-        number_of_rows = get_number_of_rows(device_property)
+        values = [get_value(device, key) for key in keys]
+
+        number_of_rows = get_number_of_rows(dict(zip(columns, values)))
         if not number_of_rows:
             logger.error('number of rows are different for some columns')
             continue
-        logger.debug(f'number_of_rows={number_of_rows}')
 
         # first add header if user wants it
         if 'header' in task and not header_written:
             header_written = True
-            row = []
-            for column in columns:
-                row.append(column)
-            data_to_export.append(row)
+            yield list(columns)
 
         # loop through the number of rows
         for n in range(number_of_rows):
-            # initialize empty row
-            row = [None] * len(columns)
-            # and set column to 0
-            number_of_column = 0
-            for column in columns:
-                # check if we have to calculate an MD5 sum
-                if 'checksum' in column:
-                    calculate_checksum = True
-                if isinstance(device_property[column], str):
-                    row[number_of_column] = device_property[column]
-                else:
-                    if device_property[column] is None:
-                        row[number_of_column] = 'null'
-                    else:
-                        dta =  device_property[column][n]
-                        if isinstance(dta, list):
-                            if len(dta) > 0:
-                                row[number_of_column] = dta[0]
-                            else:
-                                row[number_of_column] = ""
-                        else:
-                            row[number_of_column] = dta
-                number_of_column += 1
+            row = [get_cell(value, n) for value in values]
             # calculate checksum if necessary
             if calculate_checksum:
-                row[len(columns)-1] = tools.calculate_md5(row)
-
-            # now put row to the list of exported values
-            data_to_export.append(row)
-    return data_to_export
+                row[-1] = tools.calculate_md5(row)
+            yield row
 
 def export_device_properties(sot, playbook, task, devices):
-    data_to_export = get_device_data_to_export(sot, task, devices)
-    if len(data_to_export) == 0:
+    rows = iter_device_data_to_export(task, devices)
+    # the file is only written if there is at least one row
+    first_row = next(rows, None)
+    if first_row is None:
         logger.bind(extra='export').info('got no data to export')
         return
+    rows = itertools.chain([first_row], rows)
     if task.get('format') == 'csv':
-        return export_device_properties_as_csv(task, data_to_export)
+        return export_device_properties_as_csv(task, rows)
     if task.get('format') == 'excel' or task.get('format') == 'xlsx':
-        return export_device_properties_as_xlsxl(task, data_to_export)
+        return export_device_properties_as_xlsxl(task, rows)
 
 #
 # export devcice to xlsx
 #
 
-def export_device_to_xlsx(sot, playbook, task, devices):
+def get_device_values(device, columns):
+    """return list of (property, value) of the device sheet"""
+    values = []
+    for property in columns['device']:
+        value = device.get(property)
+        if value:
+            if 'tags' == property:
+                value = ",".join([tag['name'] for tag in value])
+            elif 'vrfs' == property:
+                list_of_vrfs = []
+                for vrf in value:
+                    vrf_name = vrf.get('name','')
+                    vrf_namespace = vrf.get('namespace',{}).get('name','')
+                    list_of_vrfs.append(f'{vrf_name}({vrf_namespace})')
+                value = ",".join(list_of_vrfs)
+            elif isinstance(value, list) and len(value) == 0:
+                continue
+            values.append((property, value))
+    return values
+
+def get_interface_columns(columns):
+    """return list of (property, list item, sub item) of the interface sheet
+
+    some properties are lists, eg. ip_addresses[x].address or
+    tagged_vlans[x].vid; we get the values and concat them to a
+    ','.join string
+    """
+    interface_columns = []
+    for property in columns['interfaces']:
+        match = re.match(r"(.*?)\[x\]\.(.*)", property)
+        if match:
+            interface_columns.append((property, match.group(1), match.group(2)))
+        else:
+            interface_columns.append((property, None, None))
+    return interface_columns
+
+def get_keypath(data, keypath):
+    """return the value of a keypath like untagged_vlan.vid"""
+    for key in keypath.split('.'):
+        data = data[key]
+    return data
+
+def get_interface_values(dev, interface_columns):
+    """return the rows of the interface sheet (without header)
+
+    A benedict per interface is expensive; the keypaths of the interface
+    columns are resolved by get_keypath.
+    """
+    rows = []
+    for interface in dev.get('interfaces',[]):
+        values = []
+        for property, list_item, sub_item in interface_columns:
+            if list_item:
+                value = ','.join([str(get_keypath(item, sub_item)) for item in interface[list_item]])
+            else:
+                try:
+                    value = get_keypath(interface, property)
+                except Exception:
+                    value = ''
+            values.append(value)
+        rows.append(values)
+    return rows
+
+def get_interface_table(name, headers, first_row, last_row):
+    interface_table = Table(
+        displayName=name,
+        ref=f'A{first_row}:{get_column_letter(len(headers))}{last_row}')
+    interface_table.tableStyleInfo = TableStyleInfo(
+        name="TableStyleMedium2", 
+        showFirstColumn=False,
+        showLastColumn=False, 
+        showRowStripes=True, 
+        showColumnStripes=False)
+    return interface_table
+
+def get_device_benedict(dev):
+    """return a benedict to get all values of the device
+
+    The interfaces are read without benedict; converting them is the most
+    expensive part of a large device.
+    """
+    return benedict({key: value for key, value in dev.items() if key != 'interfaces'}, 
+                    keyattr_dynamic=True)
+
+def save_device_workbook(task, dev):
+    """write the device and its interfaces to a workbook of its own"""
+    columns = task.get('columns')
+    colors = task.get('colors')
 
-    # get the columns we have to export
+    device = get_device_benedict(dev)
+    name = device.get('name')
+    logger.configure(extra={"extra": name})
+
+    # create workbook and sheets (Device - renamed - , Interfaces)
+    workbook = Workbook()
+    device_sheet = workbook.active
+    device_sheet.title = "Device"
+    interfaces_sheet = workbook.create_sheet("Interfaces")
+    interfaces_sheet.title = "Interfaces"
+    interfaces_sheet.sheet_properties.tabColor = "1072BA"
+
+    # add header and style cells
+    ft = Font(color=colors.get('header_font', 'FFFFFF'))
+    header_color = colors.get('header','004c81ba')
+    a1 = device_sheet["A1"]
+    b1 = device_sheet["B1"]
+    a1.value = "Property"
+    b1.value = "Value"
+    a1.font = ft
+    b1.font = ft
+    a1.fill = PatternFill(
+                start_color=header_color, end_color=header_color, fill_type = "solid")
+    b1.fill = PatternFill(
+                start_color=header_color, end_color=header_color, fill_type = "solid")
+
+    # add device data to 'Device' sheets
+    for row, (property, value) in enumerate(get_device_values(device, columns), start=2):
+        device_sheet.cell(column=1, row=row).value = property
+        device_sheet.cell(column=2, row=row).value = value
+        color = colors.get(property, colors.get('default','00FFFFFF'))
+        device_sheet.cell(column=1, row=row).fill = PatternFill(
+                start_color=color, end_color=color, fill_type = "solid")
+        device_sheet.cell(column=2, row=row).fill = PatternFill(
+                start_color=color, end_color=color, fill_type = "solid")
+
+    # add header and data to interface sheet
+    interface_headers = list(columns['interfaces'])
+    interfaces_sheet.append(interface_headers)
+    interface_rows = get_interface_values(dev, get_interface_columns(columns))
+    for values in interface_rows:
+        interfaces_sheet.append(values)
+
+    # and format interface sheet as table
+    interfaces_sheet.add_table(
+        get_interface_table("Interfaces", interface_headers, 1, len(interface_rows) + 1))
+
+    set_column_width(device_sheet, 1.0)
+    set_column_width(interfaces_sheet)
+
+    # create directory if it does not exsists and save it
+    filename = task.get('filename').replace('__name__', name)
+    directory = os.path.dirname(filename)
+    if not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+
+    workbook.save(filename=filename)
+    return filename
+
+def get_sheet_title(name, titles):
+    """return a unique and valid title of a worksheet"""
+    title = re.sub(r'[\[\]:*?/\\]', '_', name or 'device')[:31]
+    n = 1
+    while title.lower() in titles:
+        suffix = f'_{n}'
+        title = title[:31 - len(suffix)] + suffix
+        n += 1
+    titles.add(title.lower())
+    return title
+
+def write_device_sheet(workbook, task, dev, titles):
+    """write the device and its interfaces to one sheet of a write-only workbook
+
+    The properties of the device are followed by the table of its
+    interfaces.
+    """
     columns = task.get('columns')
     colors = task.get('colors')
+    device = get_device_benedict(dev)
+    name = device.get('name')
+
+    sheet = workbook.create_sheet(get_sheet_title(name, titles))
+    device_values = get_device_values(device, columns)
+    interface_headers = list(columns['interfaces'])
+    interface_rows = get_interface_values(dev, get_interface_columns(columns))
+
+    # the column widths must be set before the first row is written
+    widths = {}
+    for values in itertools.chain(device_values, [interface_headers], interface_rows):
+        for column, value in enumerate(values, start=1):
+            widths[column] = max(widths.get(column, 0), len(str(value)))
+    for column, width in widths.items():
+        sheet.column_dimensions[get_column_letter(column)].width = (width + 2) * 1.1
+
+    def styled(value, color, font=None):
+        cell = WriteOnlyCell(sheet, value=value)
+        cell.fill = PatternFill(start_color=color, end_color=color, fill_type = "solid")
+        if font:
+            cell.font = font
+        return cell
+
+    ft = Font(color=colors.get('header_font', 'FFFFFF'))
+    header_color = colors.get('header','004c81ba')
+    sheet.append([styled("Property", header_color, ft), styled("Value", header_color, ft)])
+    for property, value in device_values:
+        color = colors.get(property, colors.get('default','00FFFFFF'))
+        sheet.append([styled(property, color), styled(value, color)])
+
+    # an empty row between the device and its interfaces
+    sheet.append([])
+    first_row = len(device_values) + 3
+    sheet.append(interface_headers)
+    for values in interface_rows:
+        sheet.append(values)
+    if interface_rows:
+        interface_table = get_interface_table(
+            f'Interfaces_{len(titles)}', interface_headers, first_row, first_row + len(interface_rows))
+        # the columns of a table must be set in write-only mode
+        interface_table.tableColumns = [TableColumn(id=i, name=str(header)) 
+                                        for i, header in enumerate(interface_headers, start=1)]
+        # openpyxl warns about every table of a write-only sheet even if
+        # the columns are set as they are above
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore',
+                                    message='In write-only mode you must add table columns manually',
+                                    category=UserWarning)
+            sheet.add_table(interface_table)
+
+def export_devices_to_workbook(task, devices):
+    """write all devices to one workbook; each device is a sheet of its own
+
+    The workbook is write-only, so sheets are written to disk when the
+    next sheet is created. The workbook is zipped once when it is saved.
+    """
+    filename = task.get('workbook')
+    directory = os.path.dirname(filename)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
 
+    workbook = Workbook(write_only=True)
+    titles = set()
     for dev in devices:
-        # we need a benedict to get all values of the device
-        device = benedict(dev, keyattr_dynamic=True)
-        #print(json.dumps(device, indent=4))
-        name = device.get('name')
-        logger.configure(extra={"extra": name})
-
-        # create workbook and sheets (Device - renamed - , Interfaces)
-        workbook = Workbook()
-        device_sheet = workbook.active
-        device_sheet.title = "Device"
-        interfaces_sheet = workbook.create_sheet("Interfaces")
-        interfaces_sheet.title = "Interfaces"
-        interfaces_sheet.sheet_properties.tabColor = "1072BA"
-
-        # we need two lists
-        list_of_tags = []
-        list_of_vrfs = []
-
-        # add header and style cells
-        row = 2
-        ft = Font(color=colors.get('header_font', 'FFFFFF'))
-        header_color = colors.get('header','004c81ba')
-        a1 = device_sheet["A1"]
-        b1 = device_sheet["B1"]
-        a1.value = "Property"
-        b1.value = "Value"
-        a1.font = ft
-        b1.font = ft
-        a1.fill = PatternFill(
-                    start_color=header_color, end_color=header_color, fill_type = "solid")
-        b1.fill = PatternFill(
-                    start_color=header_color, end_color=header_color, fill_type = "solid")
-
-        # add device data to 'Device' sheets
-        for property in columns['device']:
-            value = device.get(property)
-            if value:
-                if 'tags' == property:
-                    for tag in value:
-                        list_of_tags.append(tag['name'])
-                    value = ",".join(list_of_tags)
-                elif 'vrfs' == property:
-                    for vrf in value:
-                        vrf_name = vrf.get('name','')
-                        vrf_namespace = vrf.get('namespace',{}).get('name','')
-                        list_of_vrfs.append(f'{vrf_name}({vrf_namespace})')
-                    value = ",".join(list_of_vrfs)
-                elif isinstance(value, list) and len(value) == 0:
-                    continue
-                logger.debug(f'key={property} value={value}')
-                device_sheet.cell(column=1, row=row).value = property
-                device_sheet.cell(column=2, row=row).value = value
-                color = colors.get(property, colors.get('default','00FFFFFF'))
-                device_sheet.cell(column=1, row=row).fill = PatternFill(
-                        start_color=color, end_color=color, fill_type = "solid")
-                device_sheet.cell(column=2, row=row).fill = PatternFill(
-                        start_color=color, end_color=color, fill_type = "solid")
-                row += 1
-
-        # get list of interfaces
-        interfaces = device.get('interfaces',[])
-
-        # add header to interface sheet
-        # this list is dynamic beacause some interfaces may
-        # have multiple IP addresses and for each address we have to add one column
-        interface_headers = []
-
-        # add header to interfaces sheet
-        
-        for property in columns['interfaces']:
-            interface_headers.append(property)
-        interfaces_sheet.append(interface_headers)
-
-        # add data to interface_values
-        for iface in interfaces:
-            interface = benedict(iface, keyattr_dynamic=True)
-            values = []
-            for property in columns['interfaces']:
-                # some properties are lists
-                # ip_addresses[x].address or tagged_vlans[x].vid
-                # we get the values and concat them to a ','.join string
-                match = re.match("(.*?)\[x\]\.(.*)", property)
-                if match:
-                    logger.debug(f'found [x] identifier in {property}')
-                    list_item = match.groups(1)[0]
-                    sub_item = match.groups(1)[1]
-                    items = interface[list_item]
-                    list_of_values = []
-                    for item in items:
-                        list_of_values.append(str(item[sub_item]))
-                    value = ','.join(list_of_values)
-                else:
-                    try:
-                        value = interface[property]
-                    except Exception:
-                        value = ''
-                logger.debug(f'key={property} value={value}')
-                values.append(value)
-            interfaces_sheet.append(values)
-  
-        # and format interface sheet as table
-        interfaces_col = chr(64+len(interface_headers))
-        interfaces_row = len(interfaces) + 1
-        logger.debug(f'interface table: A1:{interfaces_col}{interfaces_row}')
-        interface_table = Table(displayName="Interfaces", ref=f'A1:{interfaces_col}{interfaces_row}')
-        style = TableStyleInfo(
-            name="TableStyleMedium2", 
-            showFirstColumn=False,
-            showLastColumn=False, 
-            showRowStripes=True, 
-            showColumnStripes=False)
-        interface_table.tableStyleInfo = style
-        interfaces_sheet.add_table(interface_table)
-
-        set_column_width(device_sheet, 1.0)
-        set_column_width(interfaces_sheet)
-
-        # create directory if it does not exsists and save it
-        filename = task.get('filename').replace('__name__', name)
-        directory = os.path.dirname(filename)
-        if not os.path.exists(directory):
-            os.makedirs(directory)
+        logger.configure(extra={"extra": dev.get('name')})
+        write_device_sheet(workbook, task, dev, titles)
+    logger.info(f'writing {len(titles)} devices to {filename}')
+    workbook.save(filename)
 
-        workbook.save(filename=filename)
+def export_device_to_xlsx(sot, playbook, task, devices):
+    """export each device and its interfaces to xlsx
+
+    Either each device is written to a workbook of its own (filename),
+    or all devices are written as sheets of one workbook (workbook).
+    """
+    if task.get('workbook'):
+        return export_devices_to_workbook(task, devices)
+
+    for dev in devices:
+        save_device_workbook(task, dev)
 
 def set_column_width(sheet, factor=1.1):
     for column in sheet.columns:
@@ -514,6 +753,35 @@ def set_column_width(sheet, factor=1.1):
 # main
 #
 
+class PagedSelect:
+    """devices of a select that are read page by page
+
+    Only one page is kept in memory. Each task of a job iterates the
+    devices again, so each iteration reads the pages again.
+    """
+
+    def __init__(self, sot, select, using, where, page_size):
+        self._sot = sot
+        self._select = select
+        self._using = using
+        self._where = where
+        self._page_size = page_size
+
+    def __iter__(self):
+        offset = 0
+        while True:
+            devices = self._sot.select(self._select) \
+                               .using(self._using) \
+                               .set(limit=self._page_size, offset=offset) \
+                               .where(self._where)
+            if len(devices) == 0:
+                break
+            logger.debug(f'got {len(devices)} devices (offset {offset})')
+            yield from devices
+            if len(devices) < self._page_size:
+                break
+            offset += len(devices)
+
 def run_task(args, sot, playbook, tasks, devices):
     for task in tasks:
         content = task.get('content')
@@ -526,8 +794,7 @@ def run_task(args, sot, playbook, tasks, devices):
             # set username and password
             get_profile(args.profile, args.username,args.password, playbook)
 
-            for device in  devices:
-                export_config_and_facts(sot, playbook, task, device)
+            export_all_config_and_facts(sot, playbook, task, devices)
         elif 'hldm' in content:
             export_hldm(sot, playbook, task, devices)
         elif 'properties' in content:
@@ -551,11 +818,17 @@ def export(sot, playbook, args):
         select = sql.get('select')
         using = sql.get('from', sql.get('using'))
         where = sql.get('where')
+        page_size = sql.get('page_size')
         logger.debug(f'getting device_list select={select} using={using} where={where}')
-        device_list = sot.select(select) \
-                         .using(using) \
-                         .where(where)
-        logger.info(f'got {len(device_list)} devices')
+        if page_size:
+            # the devices are read page by page when a task iterates them
+            logger.info(f'reading devices in pages of {page_size}')
+            device_list = PagedSelect(sot, select, using, where, page_size)
+        else:
+            device_list = sot.select(select) \
+                             .using(using) \
+                             .where(where)
+            logger.info(f'got {len(device_list)} devices')
     tasks = job.get('tasks')
     if tasks is None:
         logger.error('no task configured!!!')
@@ -0,0 +1,66 @@
+import sys
+import functools
+from loguru import logger
+
+# veritas
+from veritas.onboarding import plugins
+
+
+LOGIC = ('device', 'interface', 'config_context')
+
+@functools.lru_cache(maxsize=None)
+def get_business_logic(logic, platform):
+    """return the business logic of a platform
+
+    The plugin is looked up once per process and logic/platform.
+    """
+    # we use our plugin architecture to use the right module
+    plugin = plugins.Plugin()
+    if logic == 'device':
+        return plugin.get_business_logic_device(platform)
+    elif logic == 'interface':
+        return plugin.get_business_logic_interface(platform)
+    elif logic == 'config_context':
+        return plugin.get_business_logic_config_context(platform)
+    else:
+        return None
+
+@functools.lru_cache(maxsize=None)
+def get_batch_hook(logic, platform):
+    """return run_batch of the module of the business logic or None
+
+    A business logic module can implement run_batch(sot, devices) to process
+    all onboarded devices at once, eg. to set tags or custom fields of many
+    devices using a single request instead of one request per device.
+    """
+    try:
+        business_logic = get_business_logic(logic, platform)
+    except Exception as exc:
+        logger.debug(f'no {logic} business logic for platform {platform}; got {exc}')
+        return None
+    if business_logic is None:
+        return None
+    module = sys.modules.get(getattr(business_logic, '__module__', None))
+    return getattr(module, 'run_batch', None)
+
+def run_batch(sot, devices):
+    """call run_batch of all business logic modules used by the devices
+
+    devices is a list of dicts containing name, platform and the
+    device_properties of the onboarded devices. Each hook is called once
+    with all devices using it.
+    """
+    hooks = {}
+    for device in devices:
+        for logic in LOGIC:
+            hook = get_batch_hook(logic, device.get('platform'))
+            if hook is not None:
+                # a module may implement more than one logic
+                hooks.setdefault(hook, {})[device.get('name')] = device
+
+    for hook, hook_devices in hooks.items():
+        logger.info(f'calling batch business logic {hook.__module__} for {len(hook_devices)} device(s)')
+        try:
+            hook(sot, list(hook_devices.values()))
+        except Exception as exc:
+            logger.error(f'batch business logic {hook.__module__} failed; got exception {exc}')
@@ -0,0 +1,74 @@
+import os
+import json
+import threading
+from datetime import datetime, timezone
+from loguru import logger
+
+
+STAGES = ('resolved', 'collected', 'parsed', 'written')
+
+class Checkpoint:
+    """journal of the stages each device has completed
+
+    The journal is an append-only JSONL file. Each line records one
+    completed stage of one device. The file is opened for each record,
+    so records of worker threads and processes do not mix up and a
+    crashed run leaves a valid journal (except the last line maybe).
+
+    If resume is set, the journal of the last run is read and extended,
+    otherwise a new journal is started.
+    """
+
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.lock = threading.Lock()
+        # hostname -> dict stage -> record
+        self.devices = {}
+        if resume:
+            self.load()
+        elif os.path.isfile(filename):
+            os.remove(filename)
+
+    def load(self):
+        if not os.path.isfile(self.filename):
+            logger.info(f'checkpoint {self.filename} not found; nothing to resume')
+            return
+        with open(self.filename) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line of a crashed run may be incomplete
+                    continue
+                self.devices.setdefault(record.get('name'), {})[record.get('stage')] = record
+        written = sum(1 for stages in self.devices.values() if 'written' in stages)
+        logger.info(f'resuming {len(self.devices)} device(s) of checkpoint {self.filename}; {written} already written')
+
+    def done(self, name, stage, **kwargs):
+        """record that the device has completed stage"""
+        record = {'name': name,
+                  'stage': stage,
+                  'time': datetime.now(timezone.utc).isoformat(),
+                  **kwargs}
+        line = json.dumps(record, default=str) + '\n'
+        with self.lock:
+            with open(self.filename, 'a') as f:
+                f.write(line)
+            self.devices.setdefault(name, {})[stage] = record
+
+    def get(self, name, stage):
+        """return the record of stage if the device has completed it or None"""
+        return self.devices.get(name, {}).get(stage)
+
+
+def read_config_and_facts(directory_name, name):
+    """read config and facts written by export_config_and_facts"""
+    config_filename = "%s/%s.conf" % (directory_name, name)
+    facts_filename = "%s/%s.facts" % (directory_name, name)
+    if not os.path.isfile(config_filename) or not os.path.isfile(facts_filename):
+        return None, None
+    with open(config_filename) as f:
+        device_config = f.read()
+    with open(facts_filename) as f:
+        device_facts = json.load(f)
+    return device_config, device_facts
@@ -0,0 +1,83 @@
+import copy
+import ipaddress
+from loguru import logger
+
+
+class DeviceDefaults:
+    """default values of our devices
+
+    The defaults are configured per prefix. The values of a device are
+    the values of all prefixes containing the address of the device,
+    beginning with the shortest prefix; longer prefixes overwrite the
+    values of shorter ones.
+
+    The values of each prefix are merged with the values of its parents
+    once, when the defaults are compiled. Getting the values of a device
+    is a lookup of the longest matching prefix, which needs at most one
+    dict lookup per configured prefix length.
+    """
+
+    def __init__(self, defaults):
+        if defaults and 'defaults' in defaults:
+            defaults = defaults.get('defaults')
+        # version -> list of (prefixlen, netmask, dict network -> merged values),
+        # longest prefix first
+        self.tables = {4: [], 6: []}
+        networks = []
+        for prefix, values in (defaults or {}).items():
+            try:
+                networks.append((ipaddress.ip_network(prefix, strict=False), values or {}))
+            except ValueError as exc:
+                logger.error(f'invalid prefix {prefix} in defaults; got exception {exc}')
+        # parents are compiled before their children
+        for network, values in sorted(networks, key=lambda n: n[0].prefixlen):
+            network_address = int(network.network_address)
+            merged = dict(self._lookup(network.version, network_address) or {})
+            merged.update(values)
+            self._get_table(network)[network_address] = merged
+        logger.debug(f'compiled defaults of {len(networks)} prefix(es)')
+
+    def _get_table(self, network):
+        tables = self.tables[network.version]
+        for prefixlen, _, nets in tables:
+            if prefixlen == network.prefixlen:
+                return nets
+        netmask = int(network.netmask)
+        tables.append((network.prefixlen, netmask, {}))
+        tables.sort(key=lambda t: t[0], reverse=True)
+        return self._get_table(network)
+
+    def _lookup(self, version, address):
+        for _, netmask, nets in self.tables[version]:
+            values = nets.get(address & netmask)
+            if values is not None:
+                return values
+        return None
+
+    def _default(self, version):
+        """return the values of 0.0.0.0/0 (or ::/0) or None"""
+        tables = self.tables[version]
+        if tables and tables[-1][0] == 0:
+            return tables[-1][2].get(0)
+        return None
+
+    def lookup(self, address):
+        """return the merged values of address; the dict must not be modified"""
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            # not an address (eg. an unresolved name); use the default values only
+            return self._default(4) or {}
+        return self._lookup(ip.version, int(ip)) or {}
+
+    def get(self, address, device_properties_from_inventory=None):
+        """return the default values of a device
+
+        The values of the inventory overwrite the default values. The
+        returned dict belongs to the caller.
+        """
+        device_defaults = copy.deepcopy(self.lookup(address))
+        for key, value in (device_properties_from_inventory or {}).items():
+            if key != 'host':
+                device_defaults[key] = value
+        return device_defaults
@@ -0,0 +1,105 @@
+import json
+from loguru import logger
+
+
+# keys of our interface properties that are not part of a nautobot interface
+# the IP addresses are assigned by sot.onboarding
+NOT_AN_INTERFACE_PROPERTY = {'ip_addresses'}
+
+def get_diff(all_interfaces, interfaces):
+    """compare parsed interfaces with the interfaces in our sot
+
+    The interfaces of our sot are indexed by name. The result is a tuple
+    of three lists:
+      - interfaces that are not in our sot
+      - (interface in sot, changed properties) of interfaces that must be updated
+      - names of interfaces that are unchanged
+    """
+    index = {nb_interface.display: nb_interface for nb_interface in all_interfaces}
+    to_add = []
+    to_update = []
+    unchanged = []
+    for interface in interfaces:
+        interface_name = interface.get('name','')
+        nb_interface = index.get(interface_name)
+        if nb_interface is None:
+            to_add.append(interface)
+            continue
+        changes = get_changes(nb_interface, interface)
+        if changes:
+            to_update.append((nb_interface, changes))
+        else:
+            unchanged.append(interface_name)
+    return to_add, to_update, unchanged
+
+def get_changes(nb_interface, interface):
+    """return the properties of interface that differ from the interface in our sot"""
+    changes = {}
+    for key, value in interface.items():
+        if key in NOT_AN_INTERFACE_PROPERTY:
+            continue
+        if not is_equal(getattr(nb_interface, key, None), value):
+            changes[key] = value
+    return changes
+
+def is_equal(current, value):
+    """compare a property of an interface in our sot with our value"""
+    if isinstance(value, list):
+        # the order of lists like tagged_vlans does not matter
+        return normalise(current or [], value) == get_sorted(value)
+    return normalise(current, value) == value
+
+def normalise(current, value):
+    """return current in the shape of value
+
+    Related objects like {'name': 'Active'} are compared by the attributes
+    used by value. Choices like the type of an interface have a value and
+    a label. Lists of related objects are sorted.
+    """
+    if current is None:
+        return None
+    if isinstance(value, dict):
+        return {key: normalise(get_attribute(current, key), item) for key, item in value.items()}
+    if isinstance(value, list):
+        shape = value[0] if len(value) > 0 else None
+        return get_sorted([normalise(item, shape) for item in current])
+    if current != value and hasattr(current, 'value'):
+        return current.value
+    return current
+
+def get_attribute(current, key):
+    if isinstance(current, dict):
+        return current.get(key)
+    return getattr(current, key, None)
+
+def get_sorted(items):
+    return sorted(items, key=lambda item: json.dumps(item, sort_keys=True, default=str))
+
+def bulk_update(rest, to_update):
+    """update interfaces using a single PATCH request
+
+    Returns True if all interfaces were updated. If the bulk request fails,
+    the interfaces are updated one by one.
+    """
+    if len(to_update) == 0:
+        return True
+    data = [{'id': nb_interface.id, **changes} for nb_interface, changes in to_update]
+    if rest is not None:
+        try:
+            response = rest.patch(url="api/dcim/interfaces/", json=data)
+            if response.status_code == 200:
+                return True
+            logger.error(f'bulk update of {len(data)} interface(s) failed; got error {response.content}')
+        except Exception as exc:
+            logger.error(f'bulk update of {len(data)} interface(s) failed; got exception {exc}')
+    logger.debug(f'updating {len(data)} interface(s) one by one')
+    success = True
+    for nb_interface, changes in to_update:
+        try:
+            if not nb_interface.update(changes):
+                logger.error(f'could not update interface {nb_interface.display}')
+                success = False
+        except Exception as exc:
+            logger.error(f'could not update interface {nb_interface.display}; got exception {exc}')
+            success = False
+    return success
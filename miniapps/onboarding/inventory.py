@@ -0,0 +1,141 @@
+import csv
+import yaml
+from loguru import logger
+
+
+class Mapping:
+    """compiled mapping of the columns of an inventory
+
+    The mapping contains 'keys' to rename columns and 'values' to rename
+    values of a column (a flat mapping is used to rename columns), eg.
+
+        keys:
+          hostname: name
+        values:
+          platform:
+            IOS: ios
+
+    The mapping is compiled once per header, so mapping a row does not
+    look up the mapping per cell.
+    """
+
+    def __init__(self, mapping=None):
+        mapping = mapping or {}
+        if 'keys' not in mapping and 'values' not in mapping:
+            # a flat mapping renames columns only
+            mapping = {'keys': mapping}
+        self.keys = mapping.get('keys', {}) or {}
+        self.values = mapping.get('values', {}) or {}
+
+    def compile(self, header):
+        """return list of (position, key, value mapping) of the header"""
+        columns = []
+        for position, column in enumerate(header):
+            if column is None or column == '':
+                continue
+            key = self.keys.get(column, column)
+            columns.append((position, key, self.values.get(key)))
+        return columns
+
+    def map_dict(self, row):
+        """map a row that is already a dict (eg. read from YAML)"""
+        device = {}
+        for column, value in row.items():
+            key = self.keys.get(column, column)
+            values = self.values.get(key)
+            device[key] = map_value(values, value)
+        return device
+
+
+def map_value(values, value):
+    if values and isinstance(value, (str, int, float, bool)):
+        return values.get(value, value)
+    return value
+
+def map_row(columns, row):
+    device = {}
+    for position, key, values in columns:
+        value = row[position] if position < len(row) else None
+        if value is None or value == '':
+            continue
+        device[key] = map_value(values, value)
+    return device
+
+def read_inventory(filename, mapping=None, csv_config=None):
+    """yield the devices of an inventory (xlsx, csv or yaml) one by one
+
+    The inventory is never read into memory as a whole. Empty rows are
+    skipped.
+    """
+    mapping = Mapping(mapping)
+    if filename.endswith('.xlsx'):
+        rows = read_xlsx(filename, mapping)
+    elif filename.endswith('.csv'):
+        rows = read_csv(filename, mapping, csv_config or {})
+    elif filename.endswith('.yaml') or filename.endswith('.yml'):
+        rows = read_yaml(filename, mapping)
+    else:
+        logger.error(f'unknown format of inventory {filename}')
+        return
+    for device in rows:
+        if device:
+            yield device
+
+def read_xlsx(filename, mapping):
+    # openpyxl is only needed if we read an xlsx inventory
+    from openpyxl import load_workbook
+
+    logger.debug(f'reading inventory {filename}')
+    workbook = load_workbook(filename, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = mapping.compile(header)
+        for row in rows:
+            yield map_row(columns, row)
+    finally:
+        workbook.close()
+
+def read_csv(filename, mapping, csv_config):
+    delimiter = csv_config.get('delimiter',',')
+    quotechar = csv_config.get('quotechar','|')
+    quoting_cf = csv_config.get('quoting','minimal')
+    newline = csv_config.get('newline','')
+    if quoting_cf == "none":
+        quoting = csv.QUOTE_NONE
+    elif quoting_cf == "all":
+        quoting = csv.QUOTE_ALL
+    elif quoting_cf == "nonnumeric":
+        quoting = csv.QUOTE_NONNUMERIC
+    else:
+        quoting = csv.QUOTE_MINIMAL
+    logger.debug(f'reading inventory {filename} delimiter={delimiter} quotechar={quotechar} quoting={quoting_cf}')
+
+    with open(filename, newline=newline) as csvfile:
+        rows = csv.reader(csvfile, delimiter=delimiter, quoting=quoting, quotechar=quotechar)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = mapping.compile(header)
+        for row in rows:
+            yield map_row(columns, row)
+
+def read_yaml(filename, mapping):
+    """yield the items of a YAML list one by one"""
+    logger.debug(f'reading inventory {filename}')
+    with open(filename) as f:
+        loader = yaml.SafeLoader(f)
+        try:
+            # stream start, document start and start of the list
+            loader.get_event()
+            loader.get_event()
+            if not isinstance(loader.get_event(), yaml.SequenceStartEvent):
+                logger.error(f'inventory {filename} is not a list of devices')
+                return
+            while not loader.check_event(yaml.SequenceEndEvent):
+                node = loader.compose_node(None, None)
+                yield mapping.map_dict(loader.construct_document(node) or {})
+        finally:
+            loader.dispose()
@@ -0,0 +1,130 @@
+import copy
+import json
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from loguru import logger
+
+# local
+import timing
+
+
+# set in each worker process by _init_worker
+_onboarding = None
+_stages = None
+
+def _init_worker(onboarding, stages):
+    global _onboarding
+    global _stages
+    _onboarding = onboarding
+    _stages = stages
+    # drop the timings the forked worker inherited from the main process
+    timing.take()
+
+def _prepare(job):
+    """run all stages but the write stage in a worker process"""
+    # a worker process runs one job at a time, so the shallow copy does not
+    # share the sot object of the lib with another job
+    job['onboarding'] = copy.copy(_onboarding)
+    try:
+        for name, stage in _stages:
+            job['stage'] = name
+            if stage(job) is False:
+                break
+    except Exception as exc:
+        logger.error(f'stage {job["stage"]} of {job.get("name")} failed; got exception {exc}')
+        job['error'] = str(exc)
+    # neither the onboarding object, the parser nor the device of our sot
+    # are sent back to the main process; write_device reads the device again
+    job.pop('onboarding', None)
+    job.pop('configparser', None)
+    if job.get('device_facts'):
+        job['device_facts'].pop('device_in_nb', None)
+    # a worker process runs one job at a time; all its timings belong to the job
+    job['timings'] = timing.take()
+    return job
+
+def import_devices(jobs, onboarding, stages, write, processes=4):
+    """import exported configs and facts of all devices
+
+    Reading and parsing the exported configs does not need the network.
+    The stages (a list of (name, function)) are run by a pool of
+    processes, each of them uses its own copy of the onboarding object.
+    The devices are written by the main process as soon as they are
+    parsed. A VLAN is sent to our sot with the first new device that was
+    added successfully, not once per device.
+
+    Yields the jobs in the order of the inventory, the same way
+    pipeline.Pipeline.run does.
+    """
+    started = time.monotonic()
+    logger.info(f'importing devices using {processes} processes')
+    known_vlans = set()
+    processed = 0
+    written = 0
+    # the onboarding object cannot be pickled; the workers must be forked
+    with ProcessPoolExecutor(max_workers=processes,
+                             mp_context=multiprocessing.get_context('fork'),
+                             initializer=_init_worker,
+                             initargs=(onboarding, stages)) as executor:
+        for job in _map(executor, jobs, 2 * processes):
+            processed += 1
+            timing.add(job.pop('timings', []))
+            if 'data' in job and 'error' not in job and 'status' not in job:
+                _write(job, onboarding, write, known_vlans)
+                written += 1
+            yield job
+
+    duration = time.monotonic() - started
+    logger.info(f'imported {written} of {processed} device(s) in {duration:.1f}s '
+                f'({processed / max(duration, 0.001):.1f} devices/s)')
+
+def _map(executor, jobs, max_pending):
+    """yield the prepared jobs in order; at most max_pending jobs are submitted
+
+    executor.map would submit (and read) all jobs at once.
+    """
+    pending = deque()
+    for job in jobs:
+        pending.append(executor.submit(_prepare, job))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def _write(job, onboarding, write, known_vlans):
+    # VLANs are only sent to our sot with a new device
+    new_device = not job['device_facts'].get('is_in_sot')
+    if new_device:
+        removed = remove_known_vlans(job, known_vlans)
+        if removed:
+            logger.debug(f'{removed} VLAN(s) of {job.get("name")} were already added')
+    # the jobs are written one by one by the main process
+    job['onboarding'] = copy.copy(onboarding)
+    job['stage'] = 'write'
+    try:
+        write(job)
+    except Exception as exc:
+        logger.error(f'stage write of {job.get("name")} failed; got exception {exc}')
+        job['error'] = str(exc)
+    job.pop('onboarding')
+    if new_device and 'error' not in job and 'status' not in job:
+        add_known_vlans(job, known_vlans)
+
+def get_vlan_key(vlan):
+    return json.dumps(vlan, sort_keys=True, default=str)
+
+def remove_known_vlans(job, known_vlans):
+    """remove VLANs that were already added to our sot with another device
+
+    Returns the number of removed VLANs.
+    """
+    vlans = job['data']['vlan_properties'] or []
+    job['data']['vlan_properties'] = [vlan for vlan in vlans if get_vlan_key(vlan) not in known_vlans]
+    return len(vlans) - len(job['data']['vlan_properties'])
+
+def add_known_vlans(job, known_vlans):
+    """remember the VLANs of a device that was added successfully"""
+    for vlan in job['data']['vlan_properties'] or []:
+        known_vlans.add(get_vlan_key(vlan))
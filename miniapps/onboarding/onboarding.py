@@ -5,20 +5,37 @@ import socket
 import os
 import sys
 import json
+import time
 import urllib3
 import yaml
 import importlib
+import itertools
+import copy
+from functools import partial, wraps
 from loguru import logger
 from dotenv import load_dotenv
 
 # veritas
 import veritas.logging
 import veritas.profile
+import veritas.repo
 from veritas.onboarding import plugins
 from veritas.sot import sot
 from veritas.tools import tools
 from veritas.onboarding import onboarding as onb
 
+# local
+import pipeline
+import interface_diff
+import resolver as name_resolver
+import sot_index
+import offline_import
+import business_logic
+import inventory
+import checkpoint as checkpoint_journal
+import device_defaults as defaults_resolver
+import timing
+
 
 def export_config_and_facts(device_config, device_facts, directory_name):
     config_filename = "%s/%s.conf" % (directory_name, device_facts.get('fqdn','__error__').lower())
@@ -28,9 +45,9 @@ def export_config_and_facts(device_config, device_facts, directory_name):
         return
 
     # create directory if it does not exsists
+    # several collect workers may create the directory at the same time
     directory = os.path.dirname(config_filename)
-    if not os.path.exists(directory):
-        os.makedirs(directory)
+    os.makedirs(directory, exist_ok=True)
 
     logger.info(f'export config to {config_filename}')
     with open(config_filename, 'w') as f:
@@ -39,26 +56,25 @@ def export_config_and_facts(device_config, device_facts, directory_name):
     with open(facts_filename, 'w') as f:
         f.write(json.dumps(device_facts,indent=4))
 
-def get_business_logic(logic, platform):
-    # we use our plugin architecture to use the right module
-    plugin = plugins.Plugin()
-    if logic == 'device':
-        return plugin.get_business_logic_device(platform)
-    elif logic == 'interface':
-        return plugin.get_business_logic_interface(platform)
-    elif logic == 'config_context':
-        return plugin.get_business_logic_config_context(platform)
-    else:
-        return None
+def onboard_device(sot, onboarding, args, device_facts, configparser, device_defaults, dry_run=False, rest=None):
+    """onboard new device to nautobot
+
+    rest is used to update interfaces using bulk requests
+    """
+    data = get_onboarding_data(onboarding, args, device_facts, configparser, device_defaults)
+    if data is None:
+        return
+    write_onboarding_data(sot, onboarding, args, device_facts, data, dry_run, rest)
 
-def onboard_device(sot, onboarding, args, device_facts, configparser, device_defaults, dry_run=False):
-    """onboard new device to nautobot"""
+def get_onboarding_data(onboarding, args, device_facts, configparser, device_defaults):
+    """get all properties of the device; nothing is written to our sot"""
 
     # we have some empty variables
     vlan_properties = []
     device_properties = None
     tag_properties = []
-    new_device = None
+    primary_interface = None
+    interfaces = []
 
     # we need the FQDN of the device
     if device_facts is not None and 'fqdn' in device_facts:
@@ -67,9 +83,6 @@ def onboard_device(sot, onboarding, args, device_facts, configparser, device_def
         # get fqdn from config instead
         device_fqdn = configparser.get_fqdn().lower()
 
-    # set extra parameter to logger
-    logger.configure(extra={"extra": device_fqdn})
-
     # set the name of the device
     if device_fqdn:
         device_defaults['name'] = device_fqdn
@@ -99,17 +112,18 @@ def onboard_device(sot, onboarding, args, device_facts, configparser, device_def
         #
         # this method modifies the device_defaults if needed (side effect!!!)
         #
-        bl_device = get_business_logic('device', device_defaults.get('platform'))
+        bl_device = business_logic.get_business_logic('device', device_defaults.get('platform'))
         bl_device_obj = bl_device(configparser, device_facts)
         bl_device_obj.pre_processing(device_defaults)
 
         # now get the device properties
         # the device properties depend on the default values of the device
         logger.info('getting device properties')
-        device_properties = onboarding.get_device_properties()
+        with timing.measure(device_fqdn, 'get_device_properties'):
+            device_properties = onboarding.get_device_properties()
         if not device_properties:
             logger.error('failed getting device properties')
-            return
+            return None
 
         # call the post-processing business logic for the device
         logger.info('calling device post-processing of business logic')
@@ -121,7 +135,8 @@ def onboard_device(sot, onboarding, args, device_facts, configparser, device_def
         # get vlan properties
         if args.interfaces or args.primary_only:
             logger.info('getting VLAN properties')
-            vlan_properties = onboarding.get_vlan_properties(device_properties=device_properties)
+            with timing.measure(device_fqdn, 'get_vlan_properties'):
+                vlan_properties = onboarding.get_vlan_properties(device_properties=device_properties)
 
         # get primary interface
         logger.debug('getting primary interface')
@@ -138,14 +153,15 @@ def onboard_device(sot, onboarding, args, device_facts, configparser, device_def
                            'status': primary_interface.get('status', {'name': 'Active'}) }]
         elif args.interfaces:
             logger.info('getting list of interfaces properties')
-            interfaces = onboarding.get_interface_properties()
+            with timing.measure(device_fqdn, 'get_interface_properties'):
+                interfaces = onboarding.get_interface_properties()
         else:
             logger.info('using empty list of interfaces')
             interfaces = []
 
         # call the post-processing business logic
         logger.info('calling interface post-processing of business logic')
-        bl_interface = get_business_logic('interface', device_defaults.get('platform'))
+        bl_interface = business_logic.get_business_logic('interface', device_defaults.get('platform'))
         bl_interface_obj = bl_interface(device_properties, configparser)
         interfaces = bl_interface_obj.post_processing(interfaces)
 
@@ -173,6 +189,40 @@ def onboard_device(sot, onboarding, args, device_facts, configparser, device_def
         # debugging output of all values
         logger.bind(extra='overview').debug(device_properties)
 
+    if args.tags:
+        # if the onboarding part did not run we need the device_properties
+        if not device_properties:
+            logger.info('getting device properties')
+            device_properties = onboarding.get_device_properties()
+        
+        logger.info("getting tag properties")
+        with timing.measure(device_fqdn, 'get_tag_properties'):
+            tag_properties = onboarding.get_tag_properties(device_fqdn,
+                                                           device_properties,
+                                                           device_facts)
+
+    return {'device_fqdn': device_fqdn,
+            'primary_address': primary_address,
+            'device_properties': device_properties,
+            'vlan_properties': vlan_properties,
+            'primary_interface': primary_interface,
+            'interfaces': interfaces,
+            'tag_properties': tag_properties}
+
+def write_onboarding_data(sot, onboarding, args, device_facts, data, dry_run=False, rest=None):
+    """add or update device using the data returned by get_onboarding_data
+
+    returns False if the device could not be written
+    """
+    device_fqdn = data['device_fqdn']
+    primary_address = data['primary_address']
+    device_properties = data['device_properties']
+    vlan_properties = data['vlan_properties']
+    primary_interface = data['primary_interface']
+    interfaces = data['interfaces']
+    new_device = None
+
+    if args.onboarding:
         if dry_run:
             print(f'summary of {device_fqdn}')
             if not device_facts['is_in_sot']:
@@ -195,12 +245,13 @@ def onboard_device(sot, onboarding, args, device_facts, configparser, device_def
         if not device_facts['is_in_sot']:
             logger.debug('device not found in SOT; adding it')
             # add new device to SOT
-            new_device = sot.onboarding \
-                .interfaces(interfaces) \
-                .vlans(vlan_properties) \
-                .primary_interface(primary_interface.get('name')) \
-                .add_prefix(False) \
-                .add_device(device_properties)
+            with timing.measure(device_fqdn, 'add_device'):
+                new_device = sot.onboarding \
+                    .interfaces(interfaces) \
+                    .vlans(vlan_properties) \
+                    .primary_interface(primary_interface.get('name')) \
+                    .add_prefix(False) \
+                    .add_device(device_properties)
 
             if not new_device:
                 message = 'failed to add host to nautobot'
@@ -212,6 +263,8 @@ def onboard_device(sot, onboarding, args, device_facts, configparser, device_def
                                 'message': message}
                      }
             logger.bind(result=result).journal(message)
+            if not new_device:
+                return False
         else:
             # update device properties; the device exists and args.update is set
             device_in_nb = device_facts.get('device_in_nb')
@@ -222,36 +275,43 @@ def onboard_device(sot, onboarding, args, device_facts, configparser, device_def
 
             if not new_device:
                 logger.error(f'could not get device {device_fqdn} from SOT')
-                return
+                return False
             else:
                 logger.debug('updating device properties')
-                new_device.update(device_properties)
+                with timing.measure(device_fqdn, 'update_device'):
+                    new_device.update(device_properties)
 
             if args.interfaces or args.primary_only:
                 # get ALL interfaces of our device
                 logger.debug('getting the list of all interfaces')
-                all_interfaces = sot.get.interfaces(device_id=new_device.id)
+                with timing.measure(device_fqdn, 'get_interfaces'):
+                    all_interfaces = sot.get.interfaces(device_id=new_device.id)
 
             if args.interfaces:
                 # if args.interfaces is set we add unknown interfaces to SOT
                 # and update ALL known interfaces as well
-                new_interfaces = []
-                for interface in interfaces:
-                    interface_name = interface.get('name','')
-                    found = False
-                    for nb_interface in all_interfaces:
-                        if interface_name == nb_interface.display:
-                            found = True
-                            nb_interface.update(interface)
-                            logger.info(f'updated interface {interface_name}')
-                    if not found:
-                        logger.info(f'adding new interface {interface_name}')                        
-                        new_interfaces.append(interface)
+                # first we compute the diff, then we write it using bulk requests
+                started = time.monotonic()
+                new_interfaces, changed_interfaces, unchanged_interfaces = interface_diff.get_diff(
+                    all_interfaces, interfaces)
+                diff_time = time.monotonic() - started
+                logger.info(f'interfaces: {len(new_interfaces)} new {len(changed_interfaces)} changed '
+                            f'{len(unchanged_interfaces)} unchanged')
+
+                started = time.monotonic()
+                with timing.measure(device_fqdn, 'update_interfaces'):
+                    updated = interface_diff.bulk_update(rest, changed_interfaces)
+                if updated:
+                    for nb_interface, changes in changed_interfaces:
+                        logger.info(f'updated interface {nb_interface.display}')
                 # update device 
                 if len(new_interfaces) > 0:
-                    sot.onboarding.add_prefix(False) \
-                                  .assign_ip(True) \
-                                  .add_interfaces(device=new_device, interfaces=new_interfaces)
+                    for interface in new_interfaces:
+                        logger.info(f'adding new interface {interface.get("name")}')
+                    with timing.measure(device_fqdn, 'add_interfaces'):
+                        sot.onboarding.add_prefix(False) \
+                                      .assign_ip(True) \
+                                      .add_interfaces(device=new_device, interfaces=new_interfaces)
                     logger.info(f'added {len(new_interfaces)} interface(s)')
 
                     result = {'app': 'onboarding',
@@ -260,25 +320,24 @@ def onboard_device(sot, onboarding, args, device_facts, configparser, device_def
                                 'message': f'added {len(new_interfaces)} interface(s)'}
                              }
                     logger.bind(result=result).journal(f'added {len(new_interfaces)} interface(s)')
+                logger.info(f'reconciled {len(interfaces)} interface(s) of {device_fqdn}; '
+                            f'diff took {diff_time:.3f}s write took {time.monotonic() - started:.3f}s')
             elif args.primary_only:
                 # update primary interface
+                nb_interface_names = {nb_interface.display for nb_interface in all_interfaces}
                 for interface in interfaces:
                     interface_name = interface.get('name','')
-                    primary_interface_found = False
-                    for nb_interface in all_interfaces:
-                        if interface_name == nb_interface.display:
-                            primary_interface_found = True
-                            sot.onboarding.add_prefix(False) \
-                                        .assign_ip(True) \
-                                        .update_interfaces(device=new_device, interfaces=interfaces)
-                            result = {'app': 'onboarding',
-                            'details': {
-                                'entity': device_fqdn,
-                                'message': f'updated primary interface {interface_name}'}
-                            }
-                            logger.bind(result=result).journal(f'updated primary interface {interface_name}')
-
-                    if not primary_interface_found:
+                    if interface_name in nb_interface_names:
+                        sot.onboarding.add_prefix(False) \
+                                    .assign_ip(True) \
+                                    .update_interfaces(device=new_device, interfaces=interfaces)
+                        result = {'app': 'onboarding',
+                        'details': {
+                            'entity': device_fqdn,
+                            'message': f'updated primary interface {interface_name}'}
+                        }
+                        logger.bind(result=result).journal(f'updated primary interface {interface_name}')
+                    else:
                         logger.info('no primary inteface found; seems to be a new one; adding it')
                         sot.onboarding.add_prefix(False) \
                                         .assign_ip(True) \
@@ -293,25 +352,17 @@ def onboard_device(sot, onboarding, args, device_facts, configparser, device_def
                 logger.info(f'the device {new_device.display} has no primary IP configured; setting it now')
             if current_primary_ip != primary_address:
                 logger.info(f'updating primary IP of device {new_device.display} from {current_primary_ip} to {primary_address}')
-                sot.onboarding.set_primary_address(primary_address, new_device)
+                with timing.measure(device_fqdn, 'set_primary_address'):
+                    sot.onboarding.set_primary_address(primary_address, new_device)
 
     if args.tags:
-        # if the onboarding part did not run we need the device_properties
-        if not device_properties:
-            logger.info('getting device properties')
-            device_properties = onboarding.get_device_properties()
-        
-        logger.info("getting tag properties")
-        tag_properties = onboarding.get_tag_properties(device_fqdn,
-                                                       device_properties,
-                                                       device_facts)
-
         if not new_device:
-            new_device = device_facts.get('device_in_nb', sot.get.device(name=device_fqdn))
+            new_device = device_facts.get('device_in_nb') or sot.get.device(name=device_fqdn)
 
-        onboarding.add_tags(hostname=device_fqdn, 
-                            tag_properties=tag_properties, 
-                            device=new_device)
+        with timing.measure(device_fqdn, 'add_tags'):
+            onboarding.add_tags(hostname=device_fqdn, 
+                                tag_properties=data['tag_properties'], 
+                                device=new_device)
 
     # # now the most import part: the config_context
     # # do your own business logic in the "businesslogic" subdir
@@ -336,6 +387,294 @@ def import_plugins(onboarding_config):
         except Exception as exc:
             logger.bind(extra='plugins').critical(f'failed to import plugin {package}.{subpackage}; got exception {exc}')
 
+def get_pipeline_config(onboarding_config, args):
+    """return number of workers of each stage of the pipeline and the import"""
+    config = onboarding_config.get('onboarding', {}).get('pipeline', {})
+    if config.get('write', 1) != 1:
+        logger.warning('the sot is written by one thread; ignoring pipeline.write')
+    # the jobs share the session and the caches of the sot object and of the
+    # onboarding object (see get_jobs); they are not safe to be written concurrently
+    return {'collect': args.collect_workers or config.get('collect', 4),
+            'parse': args.parse_workers or config.get('parse', 2),
+            'write': 1,
+            # used by --import only
+            'processes': args.processes or config.get('processes', 1)}
+
+def get_jobs(devicelist, onboarding=None):
+    """return a job for each device of the inventory
+
+    devicelist may be an iterator; the number of devices is unknown then
+    """
+    total = len(devicelist) if isinstance(devicelist, list) else None
+    for index, device_properties_from_inventory in enumerate(devicelist, start=1):
+        job = {'index': index,
+               'total': total,
+               'name': device_properties_from_inventory.get('name'),
+               'inventory': device_properties_from_inventory}
+        if onboarding is not None:
+            # the onboarding object keeps the parsed config of the device. Each
+            # job gets its own copy so that devices can be parsed concurrently.
+            # The copy is shallow; all copies share the sot object of the lib,
+            # so devices are written by a single thread
+            job['onboarding'] = copy.copy(onboarding)
+        yield job
+
+def get_inventory_mapping(onboarding_config):
+    """return mapping of the columns of the inventory read from our app config repo"""
+    filename = onboarding_config.get('onboarding', {}).get('mappings', {}).get('inventory', {}).get('filename')
+    repo_config = onboarding_config.get('git', {}).get('app_configs', {})
+    if not filename or not repo_config.get('repo'):
+        return {}
+    try:
+        repo = veritas.repo.Repository(repo=repo_config.get('repo'), path=repo_config.get('path'))
+        return yaml.safe_load(repo.get(filename)) or {}
+    except Exception as exc:
+        logger.error(f'could not read inventory mapping {filename}; got exception {exc}')
+        return {}
+
+def get_host_or_ip(device_properties_from_inventory):
+    """return host or IP of a device of our inventory"""
+    return device_properties_from_inventory.get('host', device_properties_from_inventory.get('ip'))
+
+def get_hostname(device_properties_from_inventory, host_or_ip):
+    hostname = device_properties_from_inventory.get('name', host_or_ip).lower()
+    # there is no space in a hostname!!!
+    return hostname.split(' ')[0]
+
+def device_logging(stage):
+    """run stage with the name of the device as extra field of all log messages
+
+    The stages of many devices run concurrently, so the name cannot be
+    set by logger.configure; contextualize sets it for the current thread.
+    """
+    @wraps(stage)
+    def run_stage(job, *args, **kwargs):
+        name = job.get('name')
+        if name is None:
+            host_or_ip = get_host_or_ip(job['inventory'])
+            name = get_hostname(job['inventory'], host_or_ip.lower()) if host_or_ip else 'unknown'
+        with logger.contextualize(extra=name):
+            return stage(job, *args, **kwargs)
+    return run_stage
+
+def stop(job, status, message):
+    """stop processing the job"""
+    job['status'] = status
+    job['message'] = message
+    return False
+
+@device_logging
+def collect_device(job, args, onboarding_config, export_directory, resolver, devices_in_sot, checkpoint=None,
+                   defaults_table=None):
+    """first stage: resolve device and get config and facts"""
+    onboarding = job['onboarding']
+    device_properties_from_inventory = job['inventory']
+
+    # in_sot is later set to True if the device is already in the sot
+    in_sot = False
+    device_in_nb = None
+
+    # device might be an IP ADDRESS and not the name
+    # it is possible to use 'host' or 'ip' to import a device
+    host_or_ip = get_host_or_ip(device_properties_from_inventory)
+    if not host_or_ip:
+        logger.error('failed to get host or IP; maybe you have empty rows in your inventory')
+        return stop(job, 'failed', 'no host or IP')
+
+    # the hostname is ALWAYS lower case
+    host_or_ip = host_or_ip.lower()
+    hostname = get_hostname(device_properties_from_inventory, host_or_ip)
+    # write the hostname back
+    device_properties_from_inventory['name'] = hostname
+    job['name'] = hostname
+    runs = job["index"] if job["total"] is None else f'{job["index"]}/{job["total"]}'
+    logger.info(f'processing host: {host_or_ip} hostname: {hostname} runs: {runs}')
+
+    if checkpoint and checkpoint.get(hostname, 'written'):
+        logger.info(f'{hostname} was written by the last run; skipping device')
+        return stop(job, 'skipped', 'already written by the last run')
+
+    # first we check if the file exists (and the user wants to export the config/facts)
+    # this makes the export faster
+    if args.export:
+        export_file = "%s/%s.conf" % (export_directory, hostname)
+        if os.path.exists(export_file) and not args.update:
+            logger.debug(f'config for host {hostname} already exists in export directory')
+            return stop(job, 'skipped', 'already exported')
+
+    #
+    # get the hostname of the device
+    # we need the device name to import the config from a file
+    #
+
+    # maybe the user has set a hostname instead of an address
+    # the names of the inventory were resolved before the pipeline was started
+    resolved = checkpoint.get(hostname, 'resolved') if checkpoint else None
+    device_ip = resolved.get('ip') if resolved else resolver.resolve(host_or_ip)
+    if device_ip is None:
+        device_ip = host_or_ip
+        if not args.use_import:
+            logger.error('failed to resolve ip address; we are unable to retrieve the config')
+            return stop(job, 'failed', 'failed to resolve ip address')
+    elif checkpoint and not resolved:
+        checkpoint.done(hostname, 'resolved', ip=device_ip)
+
+    if args.show_facts or args.export or args.show_config:
+        # processed later
+        pass
+    else:
+        # check if device is already in sot
+        # the devices of a large inventory were looked up before the pipeline
+        # was started; the device itself is read by the write stage if it has
+        # to be updated. A small inventory is checked device by device and
+        # the device is passed to the write stage.
+        with timing.measure(hostname, 'device_in_sot'):
+            found = devices_in_sot.lookup(hostname, device_ip)
+        in_sot = found is not None
+        if in_sot and not isinstance(found, str):
+            device_in_nb = found
+
+        if in_sot and not args.update:
+            logger.info(f'device {hostname} is already in sot and update is not active')
+            return stop(job, 'skipped', 'already in sot')
+        else:
+            logger.debug(f'device {hostname} is new or will be updated')
+
+    # get device default of this host
+    # the defaults were compiled before the pipeline was started
+    with timing.measure(hostname, 'get_device_defaults'):
+        if defaults_table:
+            device_defaults = defaults_table.get(device_ip, device_properties_from_inventory)
+        else:
+            device_defaults = onboarding.get_device_defaults(
+                host_or_ip, 
+                device_properties_from_inventory)
+
+    # now we have all the device defaults
+    # If 'ignore' is set, the device will not be processed.
+    if device_defaults.get('ignore', False):
+        logger.info(f'ignore set to true on {hostname}; skipping device')
+        return stop(job, 'skipped', 'ignore is set')
+
+    # If 'offline' is set we add the device using some default values
+    # the config of offline devices is not kept by the checkpoint
+    collected = False
+    if device_defaults.get('offline', False):
+        if args.onboarding:
+            logger.info(f'adding {hostname} offline to the sot')
+            # we use our plugin architecture to use the right module
+            plugin = plugins.Plugin()
+            offline_importer = plugin.get_offline_importer()
+            with timing.measure(hostname, 'offline_importer'):
+                device_config, device_facts, platform = offline_importer(
+                    device_ip, 
+                    device_defaults, 
+                    onboarding_config)
+            if not device_config:
+                logger.error('got no device config')
+                return stop(job, 'failed', 'got no device config')
+        elif args.export:
+            logger.info(f'device {hostname} is marked as "offline"')
+            return stop(job, 'skipped', 'device is offline')
+        else:
+            logger.error('device is offline but --onboarding is not set')
+            return stop(job, 'failed', 'device is offline but --onboarding is not set')
+    else:
+        # this device is 'online'
+        # get config and facts from device
+        # or use config and facts collected by the last run
+        platform = device_defaults.get('platform','ios')
+        collected = checkpoint.get(hostname, 'collected') if checkpoint else None
+        if collected:
+            logger.debug(f'using config and facts of {hostname} collected by the last run')
+            device_config, device_facts = checkpoint_journal.read_config_and_facts(
+                export_directory, collected.get('file'))
+        if not collected or device_config is None:
+            with timing.measure(hostname, 'get_device_config_and_facts'):
+                device_config, device_facts = onboarding.get_device_config_and_facts(
+                                device_ip=device_ip, 
+                                device_defaults=device_defaults,
+                                import_config=args.use_import,
+                                import_filename=hostname)
+            collected = None
+
+    if device_config is None or device_facts is None:
+        logger.error('got no device config or no facts')
+        return stop(job, 'failed', 'got no device config or no facts')
+
+    # configs read by --import are read again when the run is resumed
+    if checkpoint and collected is None and isinstance(device_config, str) and not args.use_import:
+        # we keep config and facts to resume an interrupted run
+        if not args.export:
+            export_config_and_facts(device_config, device_facts, export_directory)
+        checkpoint.done(hostname, 'collected', file=device_facts.get('fqdn', hostname).lower())
+
+    # we keep in mind that this device is in our sot but 
+    # only if we do not export config/facts
+    # otherwise this would be exported as well!
+    if not args.export:
+        device_facts['is_in_sot'] = in_sot
+        device_facts['device_in_nb'] = device_in_nb
+        device_facts['ip'] = device_ip
+
+    job.update({'device_ip': device_ip,
+                'device_defaults': device_defaults,
+                'device_config': device_config,
+                'device_facts': device_facts,
+                'platform': platform})
+
+    if args.export:
+        export_config_and_facts(device_config, device_facts, export_directory)
+    # facts and config are printed in the order of the inventory by the main loop
+    return not (args.show_facts or args.show_config or args.export)
+
+@device_logging
+def parse_device(job, checkpoint=None):
+    """second stage: parse config to get interfaces and so on"""
+    with timing.measure(job['name'], 'parse_config'):
+        job['configparser'] = job['onboarding'].parse_config(
+            job['device_config'],
+            job['device_facts'],
+            job['device_defaults'])
+    if checkpoint:
+        checkpoint.done(job['name'], 'parsed')
+
+@device_logging
+def prepare_device(job, args):
+    """get all properties of the device"""
+    with timing.measure(job['name'], 'get_onboarding_data'):
+        job['data'] = get_onboarding_data(job['onboarding'],
+                                          args,
+                                          job['device_facts'],
+                                          job['configparser'],
+                                          job['device_defaults'])
+    if job['data'] is None:
+        return stop(job, 'failed', 'failed getting device properties')
+
+@device_logging
+def write_device(job, sot, args, rest=None, checkpoint=None):
+    """last stage: add or update device in our sot"""
+    device_facts = job['device_facts']
+    if device_facts.get('is_in_sot') and not device_facts.get('device_in_nb'):
+        # the device has to be updated; now we need the device itself
+        with timing.measure(job['name'], 'get_device'):
+            device_facts['device_in_nb'] = job['onboarding'].device_in_sot(job['device_ip'], job['name'])
+    # the properties of the device are computed by the offline import in advance
+    if 'data' not in job and prepare_device(job, args) is False:
+        return False
+    with timing.measure(job['name'], 'write_onboarding_data'):
+        written = write_onboarding_data(sot,
+                                        job['onboarding'],
+                                        args,
+                                        device_facts,
+                                        job['data'],
+                                        args.dry_run,
+                                        rest)
+    if written is False:
+        return stop(job, 'failed', 'could not write device')
+    if checkpoint and not args.dry_run:
+        checkpoint.done(job['name'], 'written')
+
 if __name__ == "__main__":
 
     # to disable warning if TLS warning is written to console
@@ -364,6 +703,14 @@ if __name__ == "__main__":
     parser.add_argument('--show-facts', action='store_true', help='show facts only and exit')
     parser.add_argument('--show-config', action='store_true', help='show config only and exit')
     parser.add_argument('--dry-run', action='store_true', help='show key/values but do not onboard')
+    parser.add_argument('--checkpoint', action='store_true', help='write a checkpoint journal to resume this run')
+    parser.add_argument('--resume', action='store_true', help='resume the last run using its checkpoint journal')
+    parser.add_argument('--timings', action='store_true', help='print timings of all stages when done')
+    parser.add_argument('--trace', type=str, required=False, help='write timings to file (Chrome trace format)')
+    # number of devices processed concurrently by each stage
+    parser.add_argument('--collect-workers', type=int, required=False, help='number of threads used to get config and facts')
+    parser.add_argument('--parse-workers', type=int, required=False, help='number of threads used to parse configs')
+    parser.add_argument('--processes', type=int, required=False, help='number of processes used to parse configs imported by --import')
     # the user can enter a different config file
     parser.add_argument('--config', type=str, required=False, help="used other config file")
     # where do we get our data from
@@ -372,6 +719,7 @@ if __name__ == "__main__":
     parser.add_argument('--sot', type=str, required=False, help="use nautobot to get devicelist")
     parser.add_argument('--import', action='store_true', dest='use_import', help='import config and facts from file')
     parser.add_argument('--filter', type=str, help='simple filter (hostname includes) to filter inventory')
+    parser.add_argument('--hosts-file', type=str, required=False, help='resolve names using this file (format of /etc/hosts) first')
     # we need username and password if the config is retrieved by the device
     # credentials can be configured using a profile
     # have a look at the config file
@@ -445,6 +793,13 @@ if __name__ == "__main__":
                   ssl_verify=onboarding_config['sot'].get('ssl_verify', False),
                   debug=args.debug_veritas)
 
+    # the REST API is used to update interfaces using bulk requests
+    rest = sot.rest(url=onboarding_config['sot']['nautobot'],
+                    token=onboarding_config['sot']['token'],
+                    verify_ssl=onboarding_config['sot'].get('ssl_verify', False),
+                    debug=False)
+    rest.session()
+
     # create onboarding instance
     onboarding = onb.Onboarding(
         sot=sot,
@@ -454,7 +809,7 @@ if __name__ == "__main__":
 
     # get defaults
     if args.defaults:
-        with open(args.default) as f:
+        with open(args.defaults) as f:
             try:
                 defaults = yaml.safe_load(f.read())
             except Exception as exc:
@@ -463,6 +818,13 @@ if __name__ == "__main__":
     else:
         defaults = onboarding.get_default_values_from_repo()
 
+    # the defaults are compiled once; getting the defaults of a device is a lookup
+    try:
+        defaults_table = defaults_resolver.DeviceDefaults(defaults)
+    except Exception as exc:
+        logger.error(f'could not compile default values; got exception {exc}')
+        defaults_table = None
+
     # add inventory from SOT
     if args.sot:
         sot_devicelist = sot.select('id, name, primary_ip4, platform') \
@@ -478,158 +840,125 @@ if __name__ == "__main__":
                 devicelist.append({'id': device.get('id'), 'name': hostname, 'host': primary_ip})
 
     # add inventory from file
+    # the file is read lazily while the devices are processed
     if args.inventory:
-        devicelist += onboarding.read_inventory(args.inventory)
+        devicelist = itertools.chain(
+            devicelist,
+            inventory.read_inventory(
+                args.inventory,
+                get_inventory_mapping(onboarding_config),
+                onboarding_config.get('onboarding', {}).get('inventory', {}).get('csv', {})))
 
     # add inventory from cli
     if args.device is not None:
-        for device in args.device:
-            devicelist.append({'host': device, 'name': device})
+        devicelist = itertools.chain(devicelist, [{'host': device, 'name': device} for device in args.device])
         logger.info(f'added {len(args.device)} device(s) from cli')
 
+    # simple filter: the hostname must include the filter
+    if args.filter:
+        devicelist = (device for device in devicelist if args.filter in str(device.get('name', get_host_or_ip(device))))
+
     #
-    # now loop through all devices and process one by one
+    # now process all devices
     #
-    # This is the main LOOP of this script
+    # This is the main LOOP of this script. The devices are processed by a
+    # pipeline of stages (collect, parse and write). Each stage has its own
+    # pool of threads. The results are returned in the order of the inventory.
     #
-    devices_processed = 0
-    devices_overall = len(devicelist)
-    logger.info(f'processing {len(devicelist)} device(s)')
-
-    for device_properties_from_inventory in devicelist:
-        devices_processed += 1
-
-        # in_sot is later set to True if the device is already in the sot
-        in_sot = False
-        device_in_nb = None
-
-        # device might be an IP ADDRESS and not the name
-        # it is possible to use 'host' or 'ip' to import a device
-        host_or_ip = device_properties_from_inventory.get('host', device_properties_from_inventory.get('ip'))
-        if not host_or_ip:
-            logger.error('failed to get host or IP; maybe you have empty rows in your inventory')
-            continue
-
-        # the hostname is ALWAYS lower case
-        host_or_ip = host_or_ip.lower()
-        hostname = device_properties_from_inventory.get('name', host_or_ip).lower()
-        # there is no space in a hostname!!!
-        hostname = hostname.split(' ')[0]
-        logger.configure(extra={"extra": hostname})
-        # write the hostname back
-        device_properties_from_inventory['name'] = hostname
-        export_directory = directory = "%s/%s" % (BASEDIR, onboarding_config.get('directories', {}).get('export','./export'))
-        logger.info(f'processing host: {host_or_ip} hostname: {hostname} runs: {devices_processed}/{devices_overall}')
-
-        # first we check if the file exists (and the user wants to export the config/facts)
-        # this makes the export faster
-        if args.export:
-            export_file = "%s/%s.conf" % (export_directory, hostname)
-            if os.path.exists(export_file) and not args.update:
-                logger.debug(f'config for host {hostname} already exists in export directory')
-                continue
-
-        #
-        # get the hostname of the device
-        # we need the device name to import the config from a file
-        #
-
-        try:
-            # maybe the user has set a hostname instead of an address
-            device_ip = socket.gethostbyname(host_or_ip)
-        except Exception as exc:
-            device_ip = host_or_ip
-            if not args.use_import:
-                logger.error(f'failed to resolve ip address; we are unable to retrieve the config ({exc})', exc_info=True)
-                continue
-
-        if args.show_facts or args.export or args.show_config:
-            # processed later
-            pass
-        else:
-            # check if device is already in sot
-            device_in_nb = onboarding.device_in_sot(device_ip, hostname)
-            in_sot = True if device_in_nb else False
-
-            if in_sot and not args.update:
-                logger.info(f'device {hostname} is already in sot and update is not active')
-                continue
-            else:
-                logger.debug(f'device {hostname} is new or will be updated')
-
-        # get device default of this host
-        device_defaults = onboarding.get_device_defaults(
-            host_or_ip, 
-            device_properties_from_inventory)
-
-        # now we have all the device defaults
-        # If 'ignore' is set, the device will not be processed.
-        if device_defaults.get('ignore', False):
-            logger.info(f'ignore set to true on {hostname}; skipping device')
-            continue
+    if args.timings or args.trace:
+        timing.enable()
 
-        # If 'offline' is set we add the device using some default values
-        if device_defaults.get('offline', False):
-            if args.onboarding:
-                logger.info(f'adding {hostname} offline to the sot')
-                # we use our plugin architecture to use the right module
-                plugin = plugins.Plugin()
-                offline_importer = plugin.get_offline_importer()
-                device_config, device_facts, platform = offline_importer(
-                    device_ip, 
-                    device_defaults, 
-                    onboarding_config)
-                if not device_config:
-                    logger.error('got no device config')
-                    continue
-            elif args.export:
-                logger.info(f'device {hostname} is marked as "offline"')
-                continue
-            else:
-                logger.error('device is offline but --onboarding is not set')
-                continue
-        else:
-            # this device is 'online'
-            # get config and facts from device
-            platform = device_defaults.get('platform','ios')
-            device_config, device_facts = onboarding.get_device_config_and_facts(
-                            device_ip=device_ip, 
-                            device_defaults=device_defaults,
-                            import_config=args.use_import,
-                            import_filename=hostname)
-
-        if device_config is None or device_facts is None:
-            logger.error('got no device config or no facts')
+    # check which devices are already in our sot; a large inventory is checked
+    # using a single query, a small one device by device
+    if args.show_facts or args.export or args.show_config:
+        devices_in_sot = None
+    else:
+        sot_index_config = onboarding_config.get('onboarding', {}).get('sot_index', {})
+        devices_in_sot, devicelist = sot_index.get_sot_lookup(
+            sot, onboarding, devicelist,
+            get_name=lambda device: get_hostname(device, (get_host_or_ip(device) or '').lower()),
+            min_devices=sot_index_config.get('min_devices', 100),
+            chunk_size=sot_index_config.get('chunk_size', 1000))
+
+    # resolve the names of the inventory concurrently
+    # the names are resolved in chunks before the devices enter the pipeline
+    resolver_config = onboarding_config.get('onboarding', {}).get('resolver', {})
+    resolver = name_resolver.Resolver(
+        workers=resolver_config.get('workers', 16),
+        timeout=resolver_config.get('timeout', 5),
+        hosts_file=args.hosts_file or resolver_config.get('hosts_file'))
+    devicelist = resolver.resolve_ahead(devicelist,
+                                        get_name=lambda device: (get_host_or_ip(device) or '').lower(),
+                                        chunk_size=resolver_config.get('chunk_size', 1000))
+
+    export_directory = "%s/%s" % (BASEDIR, onboarding_config.get('directories', {}).get('export','./export'))
+    workers = get_pipeline_config(onboarding_config, args)
+    logger.debug(f'using {workers["collect"]}/{workers["parse"]}/{workers["write"]} collect/parse/write workers')
+    # the checkpoint journal is used to resume an interrupted run
+    # it is only written if the user wants it (--checkpoint, --resume or configured)
+    checkpoint_config = onboarding_config.get('onboarding', {}).get('checkpoint') or {}
+    use_checkpoint = args.checkpoint or args.resume or 'filename' in checkpoint_config
+    if args.show_facts or args.show_config or not use_checkpoint:
+        checkpoint = None
+    else:
+        checkpoint_filename = os.path.join(BASEDIR, checkpoint_config.get('filename', 'onboarding.checkpoint.jsonl'))
+        checkpoint = checkpoint_journal.Checkpoint(checkpoint_filename, resume=args.resume)
+
+    collect = partial(collect_device, args=args,
+                      onboarding_config=onboarding_config,
+                      export_directory=export_directory,
+                      resolver=resolver,
+                      devices_in_sot=devices_in_sot,
+                      checkpoint=checkpoint,
+                      defaults_table=defaults_table)
+    parse = partial(parse_device, checkpoint=checkpoint)
+    write = partial(write_device, sot=sot, args=args, rest=rest, checkpoint=checkpoint)
+    onboarding_pipeline = pipeline.Pipeline([
+        ('collect', collect, workers['collect']),
+        ('parse', parse, workers['parse']),
+        ('write', write, workers['write'])])
+
+    if args.use_import and args.onboarding and workers['processes'] > 1:
+        # the exported configs and facts are parsed by a pool of processes
+        # and written by this process
+        jobs = offline_import.import_devices(
+            get_jobs(devicelist),
+            onboarding,
+            [('collect', collect),
+             ('parse', parse),
+             ('prepare', partial(prepare_device, args=args))],
+            write,
+            workers['processes'])
+    else:
+        jobs = onboarding_pipeline.run(get_jobs(devicelist, onboarding))
+
+    summary = {'done': 0, 'skipped': 0, 'failed': 0}
+    # onboarded devices are passed to the batch hooks of the business logic
+    onboarded_devices = []
+    for job in jobs:
+        status = 'failed' if 'error' in job else job.get('status', 'done')
+        summary[status] += 1
+        if status != 'done':
+            logger.debug(f'{job["name"]} {status} in stage {job["stage"]}: {job.get("error", job.get("message"))}')
             continue
-
-        # we keep in mind that this device is in our sot but 
-        # only if we do not export config/facts
-        # otherwise this would be exported as well!
-        if not args.export:
-            device_facts['is_in_sot'] = in_sot
-            device_facts['device_in_nb'] = device_in_nb
-            device_facts['ip'] = device_ip
-
+        if args.onboarding and 'data' in job:
+            onboarded_devices.append({'name': job['data']['device_fqdn'],
+                                      'platform': job['device_defaults'].get('platform'),
+                                      'device_properties': job['data']['device_properties']})
         if args.show_facts:
-            print(json.dumps(dict(device_facts), indent=4))
-            continue
-        if args.show_config:
-            print(device_config)
-            continue
-        if args.export:
-            export_config_and_facts(device_config, device_facts, export_directory)
-            continue
-
-        # parse config to get interfaces and so on
-        configparser = onboarding.parse_config(device_config, device_facts, device_defaults)
-        # call onboarding
-        onboard_device(sot,
-                       onboarding,
-                       args,
-                       device_facts,
-                       configparser,
-                       device_defaults,
-                       args.dry_run)
+            print(json.dumps(dict(job['device_facts']), indent=4))
+        elif args.show_config:
+            print(job['device_config'])
+    logger.info(f'processed {sum(summary.values())} device(s); {summary["done"]} done {summary["skipped"]} skipped {summary["failed"]} failed')
+
+    if len(onboarded_devices) > 0 and not args.dry_run:
+        with timing.measure(None, 'run_batch'):
+            business_logic.run_batch(sot, onboarded_devices)
+
+    if args.timings:
+        timing.print_summary()
+    if args.trace:
+        timing.write_trace(args.trace)
 
     # after adding all devices to our sot we add the cables
     # if args.cables:
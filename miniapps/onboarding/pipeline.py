@@ -0,0 +1,67 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from loguru import logger
+
+
+class Pipeline:
+    """process jobs by a sequence of stages
+
+    Each stage has its own bounded pool of threads. A job is handed to
+    the next stage as soon as the previous stage has finished it, so a
+    slow stage (eg. SSH) does not block the other stages. A stage gets
+    the job (a dict) and returns False if the job must not be processed
+    any further. An exception stops the job as well and is written to
+    job['error'].
+
+    run() yields the jobs in the same order as they were passed. At most
+    max_pending jobs are in the pipeline or wait to be yielded.
+    """
+
+    def __init__(self, stages, max_pending=0):
+        # stages is a list of (name, function, number of workers)
+        self.stages = stages
+        self.max_pending = max_pending or 2 * sum(max(1, workers) for _, _, workers in stages)
+
+    def run(self, jobs):
+        executors = [ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=name)
+                     for name, _, workers in self.stages]
+        pending = deque()
+        try:
+            for job in jobs:
+                while len(pending) >= self.max_pending:
+                    yield pending.popleft().result()
+                done = Future()
+                pending.append(done)
+                self._submit(executors, 0, job, done)
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def _submit(self, executors, index, job, done):
+        name, function, _ = self.stages[index]
+        job['stage'] = name
+        try:
+            future = executors[index].submit(function, job)
+        except RuntimeError as exc:
+            # the pipeline was shut down
+            job['error'] = str(exc)
+            done.set_result(job)
+            return
+        future.add_done_callback(lambda f: self._done(executors, index, job, done, f))
+
+    def _done(self, executors, index, job, done, future):
+        if future.cancelled():
+            job['error'] = 'cancelled'
+            done.set_result(job)
+            return
+        exc = future.exception()
+        if exc is not None:
+            logger.error(f'stage {job["stage"]} of {job.get("name")} failed; got exception {exc}')
+            job['error'] = str(exc)
+            done.set_result(job)
+        elif future.result() is not False and index + 1 < len(self.stages):
+            self._submit(executors, index + 1, job, done)
+        else:
+            done.set_result(job)
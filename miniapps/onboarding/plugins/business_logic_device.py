@@ -16,6 +16,11 @@ class BusinessLogic_Device(abc_bl_device.BusinessLogic_Device):
         logger.debug('post_processing device business logic')
         pass
 
+def run_batch(sot, devices):
+    # called once after all devices were onboarded
+    # devices is a list of dicts containing name, platform and device_properties
+    logger.debug(f'batch device business logic of {len(devices)} device(s)')
+
 @plugins.device_business_logic('ios')
 def device_business_logic(configparser, device_facts):
     return BusinessLogic_Device(configparser, device_facts)
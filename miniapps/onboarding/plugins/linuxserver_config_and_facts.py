@@ -1,3 +1,4 @@
+import threading
 from loguru import logger
 import paramiko
 
@@ -5,13 +6,55 @@ import paramiko
 from veritas.onboarding import plugins
 
 
+# timeout in seconds used to connect and to run the commands
+# can be overwritten by setting ssh_timeout in the defaults of the device
+TIMEOUT = 10
+# the onboarding pipeline may run more collect workers than we want to
+# open sessions to servers. The limit can be configured by setting
+# ssh_max_sessions in the defaults. All servers with the same limit share
+# one pool of sessions; set it in 0.0.0.0/0 only to limit all servers
+MAX_SESSIONS = 16
+# limit -> semaphore
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# the commands are run concurrently, each one on its own channel of
+# the same connection
+COMMANDS = {'fqdn': 'hostname',
+            'interfaces': 'ip a'}
+
+
 @plugins.config_and_facts('linux')
 def get_device_config_and_facts(device_ip, device_defaults, profile, tcp_port=22, scrapli_loglevel='none'):
+    return get_config_and_facts(device_ip, device_defaults, profile, tcp_port)
 
+def get_config_and_facts(device_ip, device_defaults, profile, tcp_port=22):
     device_config = {'fqdn': '',
                      'interfaces': {}}
     device_facts = {'fqdn':''}
+    timeout = device_defaults.get('ssh_timeout', TIMEOUT)
+
+    with get_sessions(device_defaults.get('ssh_max_sessions', MAX_SESSIONS)):
+        client = connect(device_ip, profile, tcp_port, timeout)
+        try:
+            output = run_commands(client, COMMANDS, timeout)
+        finally:
+            client.close()
+
+    device_config.update(output)
+    device_facts['fqdn'] = output.get('fqdn', '')
+
+    return device_config, device_facts
+
+def get_sessions(max_sessions):
+    """return the semaphore that limits the number of concurrent sessions"""
+    with _sessions_lock:
+        if max_sessions not in _sessions:
+            logger.debug(f'opening up to {max_sessions} concurrent sessions')
+            _sessions[max_sessions] = threading.BoundedSemaphore(max_sessions)
+        return _sessions[max_sessions]
 
+def connect(device_ip, profile, tcp_port=22, timeout=TIMEOUT):
     client = paramiko.client.SSHClient()
     # validate the trust with the machine for the first time we try to connect to the server
     # use set_missing_host_key_policy() to add the key automatically
@@ -20,28 +63,40 @@ def get_device_config_and_facts(device_ip, device_defaults, profile, tcp_port=22
     if profile.ssh_key:
         logger.debug(f'connecting to {device_ip} using ssh_key')
         client.connect(
-            device_ip, 
+            device_ip,
+            port=tcp_port,
             username=profile.username,
             look_for_keys=True,
             key_filename=profile.ssh_key,
-            passphrase=profile.ssh_passphrase)
+            passphrase=profile.ssh_passphrase,
+            timeout=timeout,
+            banner_timeout=timeout,
+            auth_timeout=timeout)
     else:
         logger.debug(f'connecting to {device_ip} using username/password')
         client.connect(
             device_ip,
+            port=tcp_port,
             username=profile.username,
-            password=profile.password)
+            password=profile.password,
+            timeout=timeout,
+            banner_timeout=timeout,
+            auth_timeout=timeout)
+    return client
 
-    # get hostname
-    _stdin, _stdout,_stderr = client.exec_command("hostname")
-    device_config['fqdn'] = _stdout.read().decode()
-    device_facts['fqdn'] = _stdout.read().decode()
+def run_commands(client, commands, timeout=TIMEOUT):
+    """run all commands concurrently and return dict key -> output"""
+    transport = client.get_transport()
+    channels = {}
+    for key, command in commands.items():
+        channel = transport.open_session(timeout=timeout)
+        channel.settimeout(timeout)
+        channel.exec_command(command)
+        channels[key] = channel
 
-    # get ip addresses
-    _stdin, _stdout,_stderr = client.exec_command("ip a")
-    device_config['interfaces'] = _stdout.read().decode()
-
-    logger.debug(f'Return code: {_stdout.channel.recv_exit_status()}')
-    client.close()
-
-    return device_config, device_facts
+    output = {}
+    for key, channel in channels.items():
+        output[key] = channel.makefile('rb').read().decode().strip()
+        logger.debug(f'{commands[key]}: return code: {channel.recv_exit_status()}')
+        channel.close()
+    return output
@@ -0,0 +1,148 @@
+import asyncio
+import ipaddress
+import socket
+import threading
+from concurrent.futures import Executor, Future
+from loguru import logger
+
+# local
+import timing
+
+
+class Resolver:
+    """resolve hostnames to IPv4 addresses
+
+    resolve_all() resolves a list of names concurrently before any device
+    is processed. Each lookup has its own timeout. The results, including
+    failed lookups, are cached so that resolve() is a dict lookup for all
+    names of the inventory.
+
+    A hosts file (the format of /etc/hosts) can be used to overwrite
+    the DNS. This is useful if the DNS is not available, eg. for tests.
+    """
+
+    def __init__(self, workers=16, timeout=5, hosts_file=None):
+        self.workers = workers
+        self.timeout = timeout
+        # name -> address or None if the name could not be resolved
+        self.cache = {}
+        if hosts_file:
+            self.cache.update(read_hosts_file(hosts_file))
+
+    def resolve(self, name):
+        """return address of name or None"""
+        if name not in self.cache:
+            self.cache[name] = self._lookup(name)
+        return self.cache[name]
+
+    def resolve_all(self, names):
+        """resolve all names that are not cached yet"""
+        names = {name for name in names if name and name not in self.cache}
+        if len(names) == 0:
+            return
+        logger.info(f'resolving {len(names)} name(s) using {self.workers} workers')
+        with timing.measure(None, 'dns'):
+            results = self._run(names)
+        self.cache.update(results)
+        failed = sum(1 for address in results.values() if address is None)
+        logger.info(f'resolved {len(results) - failed} name(s); {failed} failed')
+
+    def _run(self, names):
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(self._resolve_all(names))
+        finally:
+            loop.close()
+        return results
+
+    def resolve_ahead(self, devices, get_name, chunk_size=1000):
+        """yield devices; the names of the next chunk_size devices are
+        resolved concurrently before they are yielded"""
+        chunk = []
+        for device in devices:
+            chunk.append(device)
+            if len(chunk) >= chunk_size:
+                self.resolve_all(get_name(d) for d in chunk)
+                yield from chunk
+                chunk = []
+        self.resolve_all(get_name(d) for d in chunk)
+        yield from chunk
+
+    async def _resolve_all(self, names):
+        semaphore = asyncio.Semaphore(self.workers)
+        addresses = await asyncio.gather(*[self._resolve(semaphore, name) for name in names])
+        return dict(zip(names, addresses))
+
+    async def _resolve(self, semaphore, name):
+        if is_address(name):
+            return name
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            try:
+                # loop.getaddrinfo would use the default executor of the loop
+                infos = await asyncio.wait_for(
+                    loop.run_in_executor(_executor, socket.getaddrinfo,
+                                         name, None, socket.AF_INET, socket.SOCK_STREAM),
+                    self.timeout)
+                return infos[0][4][0]
+            except asyncio.TimeoutError:
+                logger.error(f'lookup of {name} timed out after {self.timeout}s')
+            except Exception as exc:
+                logger.debug(f'could not resolve {name}; got exception {exc}')
+            return None
+
+    def _lookup(self, name):
+        if is_address(name):
+            return name
+        try:
+            return socket.gethostbyname(name)
+        except Exception as exc:
+            logger.debug(f'could not resolve {name}; got exception {exc}')
+            return None
+
+
+class DaemonExecutor(Executor):
+    """run each call in a daemon thread of its own
+
+    A lookup that timed out cannot be stopped and may block its thread
+    until the resolver of the system gives up. The threads of a
+    ThreadPoolExecutor are joined when the interpreter exits, so such a
+    lookup would delay the exit; a daemon thread does not.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as exc:
+                future.set_exception(exc)
+
+        threading.Thread(target=run, name='resolver', daemon=True).start()
+        return future
+
+# the number of concurrent lookups is limited by the workers of the Resolver
+_executor = DaemonExecutor()
+
+def is_address(name):
+    try:
+        ipaddress.ip_address(name)
+        return True
+    except ValueError:
+        return False
+
+def read_hosts_file(filename):
+    """return dict name -> address of a file in the format of /etc/hosts"""
+    hosts = {}
+    with open(filename) as f:
+        for line in f:
+            fields = line.split('#')[0].split()
+            if len(fields) < 2:
+                continue
+            for name in fields[1:]:
+                hosts[name.lower()] = fields[0]
+    logger.debug(f'read {len(hosts)} name(s) from {filename}')
+    return hosts
@@ -0,0 +1,105 @@
+import itertools
+from loguru import logger
+
+# local
+import resolver
+import timing
+
+
+class SotIndex:
+    """names and primary addresses of the devices of our inventory that are in our sot
+
+    The index is built by index_ahead(); it sends one query per chunk of
+    the inventory before the devices of the chunk are processed. Checking
+    if a device is already in our sot is a set lookup and does not need a
+    query per device. Devices listed by their address instead of their
+    name cannot be part of the query; they are checked one by one.
+    """
+
+    def __init__(self, sot, onboarding):
+        self.sot = sot
+        self.onboarding = onboarding
+        self.names = set()
+        self.addresses = set()
+
+    def add(self, devices):
+        for device in devices:
+            hostname = device.get('hostname')
+            if hostname:
+                self.names.add(hostname.lower())
+            primary_ip4 = device.get('primary_ip4')
+            if primary_ip4 and primary_ip4.get('address'):
+                self.addresses.add(primary_ip4.get('address').split('/')[0])
+
+    def index_all(self, names):
+        """add the devices of our sot named like one of names"""
+        names = sorted({name for name in names if name and not resolver.is_address(name)})
+        if len(names) == 0:
+            return
+        with timing.measure(None, 'get_sot_index'):
+            devices = self.sot.select('hostname, primary_ip4') \
+                              .using('nb.devices') \
+                              .where(name=names)
+        self.add(devices)
+        logger.debug(f'found {len(devices)} of {len(names)} device(s) in sot')
+
+    def index_ahead(self, devices, get_name, chunk_size=1000):
+        """yield devices; the next chunk_size devices are looked up in our
+        sot before they are yielded"""
+        chunk = []
+        for device in devices:
+            chunk.append(device)
+            if len(chunk) >= chunk_size:
+                self.index_all(get_name(d) for d in chunk)
+                yield from chunk
+                chunk = []
+        self.index_all(get_name(d) for d in chunk)
+        yield from chunk
+
+    def lookup(self, hostname, device_ip):
+        """return 'name', 'ip', the device of our sot or None if the device is not in our sot"""
+        if hostname and hostname.lower() in self.names:
+            return 'name'
+        if device_ip in self.addresses:
+            return 'ip'
+        if resolver.is_address(hostname):
+            # the inventory lists an address instead of a name
+            return self.onboarding.device_in_sot(device_ip, hostname) or None
+        return None
+
+    def __len__(self):
+        return len(self.names)
+
+
+class SotLookup:
+    """checks each device of a small inventory by its own query
+
+    Building the index does not pay off if only a few devices are
+    processed.
+    """
+
+    def __init__(self, onboarding):
+        self.onboarding = onboarding
+
+    def lookup(self, hostname, device_ip):
+        """return the device of our sot or None"""
+        return self.onboarding.device_in_sot(device_ip, hostname) or None
+
+
+def get_sot_lookup(sot, onboarding, devicelist, get_name, min_devices=100, chunk_size=1000):
+    """return (lookup, devicelist)
+
+    If the inventory has less than min_devices devices, each device is
+    checked by its own query. Otherwise the devices of the inventory are
+    looked up in chunks while the devicelist is read. devicelist may be an
+    iterator; the first devices are read to count them, so the returned
+    devicelist must be used instead.
+    """
+    devicelist = iter(devicelist)
+    head = list(itertools.islice(devicelist, min_devices))
+    devicelist = itertools.chain(head, devicelist)
+    if len(head) < min_devices:
+        logger.debug(f'checking {len(head)} device(s) one by one')
+        return SotLookup(onboarding), devicelist
+    index = SotIndex(sot, onboarding)
+    return index, index.index_ahead(devicelist, get_name, chunk_size)
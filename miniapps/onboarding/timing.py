@@ -0,0 +1,115 @@
+import os
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+from loguru import logger
+
+
+# timings are only recorded if enabled
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local()
+_origin = time.perf_counter()
+# list of (device, stage, start, duration, depth, pid, thread)
+_records = []
+
+def enable():
+    global _enabled
+    _enabled = True
+
+@contextmanager
+def measure(device, stage):
+    """record the wall-clock time of stage
+
+    Stages can be nested; only stages that are not part of another stage
+    are used to compute the time of a device. device is None for stages
+    that are run once for many devices, eg. resolving the inventory.
+    """
+    if not _enabled:
+        yield
+        return
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        _local.depth = depth
+        with _lock:
+            _records.append((device, stage, started - _origin, duration, depth,
+                             os.getpid(), threading.get_ident()))
+
+def take():
+    """remove and return all timings, eg. to send them to another process"""
+    global _records
+    with _lock:
+        taken = _records
+        _records = []
+    return taken
+
+def add(records):
+    """add timings recorded by another process"""
+    with _lock:
+        _records.extend(tuple(record) for record in records)
+
+def percentile(values, p):
+    """nearest-rank percentile of sorted values"""
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+def get_summary(slowest=10):
+    """return (stages, devices)
+
+    stages is a list of (stage, count, p50, p95, max, total) and devices is
+    a list of (device, seconds) of the slowest devices.
+    """
+    with _lock:
+        records = list(_records)
+    by_stage = {}
+    by_device = {}
+    for device, stage, _, duration, depth, _, _ in records:
+        by_stage.setdefault(stage, []).append(duration)
+        if device is not None and depth == 0:
+            by_device[device] = by_device.get(device, 0) + duration
+    stages = []
+    for stage, durations in by_stage.items():
+        durations.sort()
+        stages.append((stage, len(durations), percentile(durations, 50), percentile(durations, 95),
+                       durations[-1], sum(durations)))
+    stages.sort(key=lambda s: s[5], reverse=True)
+    devices = sorted(by_device.items(), key=lambda d: d[1], reverse=True)[:slowest]
+    return stages, devices
+
+def print_summary(slowest=10):
+    stages, devices = get_summary(slowest)
+    print(f'{"stage (seconds)":<32} {"count":>7} {"p50":>9} {"p95":>9} {"max":>9} {"total":>10}')
+    for stage, count, p50, p95, maximum, total in stages:
+        print(f'{stage:<32} {count:>7} {p50:>9.3f} {p95:>9.3f} {maximum:>9.3f} {total:>10.1f}')
+    if devices:
+        print(f'\nslowest {len(devices)} device(s)')
+        for device, seconds in devices:
+            print(f'{device:<40} {seconds:>9.3f}')
+
+def write_trace(filename):
+    """write timings in the Chrome trace event format
+
+    The file can be loaded by chrome://tracing, Perfetto or speedscope.
+    """
+    with _lock:
+        records = list(_records)
+    events = []
+    for device, stage, started, duration, _, pid, thread in records:
+        events.append({'name': stage,
+                       'cat': 'onboarding',
+                       'ph': 'X',
+                       'ts': int(started * 1e6),
+                       'dur': int(duration * 1e6),
+                       'pid': pid,
+                       'tid': thread,
+                       'args': {'device': device}})
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    logger.info(f'wrote {len(events)} trace events to {filename}')
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""benchmark matching sot devices and checkmk hosts
+
+Compares the index of host_index with the linear scans sync_cmk used
+before. The time of the index must grow linearly with the number of hosts.
+
+usage: python benchmarks/host_index.py [--hosts 10000 20000 40000] [--sample 500]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import host_index
+
+
+def get_hosts(number_of_hosts):
+    """return sot devices and checkmk hosts; 5% of each side are missing on the other"""
+    missing = number_of_hosts // 20
+    sot_devices = [{'hostname': f'host-{i}.local',
+                    'primary_ip4': {'address': f'10.{i // 65536}.{i // 256 % 256}.{i % 256}/32'}}
+                   for i in range(missing, number_of_hosts)]
+    cmk_hosts = [{'host_name': f'host-{i}.local',
+                  'extensions': {'folder': f'/site{i % 50}'}}
+                 for i in range(number_of_hosts - missing)]
+    return sot_devices, cmk_hosts
+
+def match_using_index(sot_devices, cmk_hosts):
+    """match the hosts the way add_new_hosts, update_hosts and remove_hosts do"""
+    cmk_index = host_index.cmk_index(cmk_hosts)
+    sot_index = host_index.sot_index(sot_devices)
+    new = [d for d in sot_index if d['hostname'] not in cmk_index]
+    known = [cmk_index.get(d['hostname']) for d in sot_index if d['hostname'] in cmk_index]
+    removed = [h for h in cmk_index if h['host_name'] not in sot_index]
+    return len(new), len(known), len(removed)
+
+def match_linear(sot_devices, cmk_hosts, sample):
+    """time sample lookups of the former linear scans"""
+    for device in sot_devices[-sample:]:
+        next((item for item in cmk_hosts if item['host_name'] == device['hostname']), {})
+    for host in cmk_hosts[:sample]:
+        any(d['hostname'] == host['host_name'] for d in sot_devices)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hosts', type=int, nargs='*', default=[10000, 20000, 40000], help='number of hosts')
+    parser.add_argument('--sample', type=int, default=500, help='number of lookups used to estimate the linear scan')
+    args = parser.parse_args()
+
+    print(f'{"hosts":>8} {"index (s)":>10} {"per host (us)":>14} {"linear scan, estimated (s)":>27}')
+    for number_of_hosts in args.hosts:
+        sot_devices, cmk_hosts = get_hosts(number_of_hosts)
+
+        started = time.perf_counter()
+        match_using_index(sot_devices, cmk_hosts)
+        index_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        match_linear(sot_devices, cmk_hosts, args.sample)
+        # the sync does one lookup per sot device and one per checkmk host
+        linear_time = (time.perf_counter() - started) / (2 * args.sample) * (len(sot_devices) + len(cmk_hosts))
+
+        print(f'{number_of_hosts:>8} {index_time:>10.3f} {index_time / number_of_hosts * 1e6:>14.2f} {linear_time:>27.1f}')
+
+if __name__ == "__main__":
+    main()
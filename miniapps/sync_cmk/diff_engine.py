@@ -0,0 +1,42 @@
+from concurrent.futures import ProcessPoolExecutor
+from loguru import logger
+
+
+# set in each worker process by _init_worker
+_diff_device = None
+_checkmk_config = None
+
+def _init_worker(diff_device, checkmk_config):
+    global _diff_device
+    global _checkmk_config
+    _diff_device = diff_device
+    _checkmk_config = checkmk_config
+
+def _diff_chunk(chunk):
+    # the SOT object is not needed to compute the diff and is not
+    # passed to the worker processes
+    return [_diff_device(None, device, cmk_host, _checkmk_config) for device, cmk_host in chunk]
+
+def compute_changes(sot, pairs, checkmk_config, diff_device, processes=1, chunk_size=1000):
+    """compute the change records of a list of (sot device, cmk host) pairs
+
+    diff_device is called for each pair and returns the change record of
+    the device or None if the device is in sync. The devices are split
+    into chunks of chunk_size devices. If there is more than one chunk and
+    more than one process, the chunks are processed by a pool of
+    processes. The result is a list of change records in the same order
+    as pairs, so the result does not depend on the number of processes.
+    """
+    chunks = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+    if processes <= 1 or len(chunks) <= 1:
+        return [diff_device(sot, device, cmk_host, checkmk_config) for device, cmk_host in pairs]
+
+    processes = min(processes, len(chunks))
+    logger.info(f'computing diff of {len(pairs)} devices using {processes} processes')
+    changes = []
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=_init_worker,
+                             initargs=(diff_device, checkmk_config)) as executor:
+        for result in executor.map(_diff_chunk, chunks):
+            changes.extend(result)
+    return changes
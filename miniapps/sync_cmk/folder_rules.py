@@ -0,0 +1,211 @@
+import ipaddress
+import socket
+from loguru import logger
+
+
+class CidrTable:
+    """lookup table of networks
+
+    The original folder logic checks every net of a cidr rule and the
+    last matching net wins. The table stores the networks by prefix
+    length so that a lookup needs at most one dict access per prefix
+    length instead of one containment check per configured net.
+    """
+
+    def __init__(self, entries):
+        # version -> list of (prefixlen, {network_address: (position, folder)})
+        self._tables = {}
+        tables = {}
+        for position, (net, folder) in enumerate(entries):
+            network = ipaddress.ip_network(net)
+            by_prefix = tables.setdefault(network.version, {}) \
+                              .setdefault(network.prefixlen, {})
+            # the last matching net wins; keep the highest position
+            by_prefix[int(network.network_address)] = (position, folder)
+        for version, by_prefixlen in tables.items():
+            max_prefixlen = 32 if version == 4 else 128
+            self._tables[version] = [
+                (((1 << max_prefixlen) - 1) ^ ((1 << (max_prefixlen - prefixlen)) - 1), nets)
+                for prefixlen, nets in by_prefixlen.items()]
+
+    def lookup(self, ip):
+        """return (found, folder) of the last configured net containing ip"""
+        match = None
+        version, address = ip
+        for netmask, nets in self._tables.get(version, []):
+            entry = nets.get(address & netmask)
+            if entry and (match is None or entry[0] > match[0]):
+                match = entry
+        if match is None:
+            return False, None
+        return True, match[1]
+
+
+class FolderRules:
+    """compiled version of the folder structure of our config
+
+    The config is parsed once. Networks are parsed to lookup tables,
+    property paths are split and the template is split into its parts.
+    get_folder_name returns the same folder as the former per-device
+    implementation did.
+    """
+
+    def __init__(self, folder_config):
+        self.template = folder_config.get('template')
+        self.parts = None
+        self.needs_ip = False
+        if self.template and '~' in self.template:
+            self.parts = [self._compile_part(folder_config.get(item)) for item in self.template.split('~')]
+
+    def _compile_part(self, config):
+        default = config.get('default')
+        rules = []
+        # the order of the keys is important; the last rule that sets
+        # a folder wins
+        for key, value in config.items():
+            if key == 'custom_field':
+                rules.append(('custom_field', (value, value.replace('cf_',''))))
+            elif key == 'property':
+                rules.append(('property', value.split('__')))
+            elif key == 'cidr':
+                self.needs_ip = True
+                table = CidrTable([(item.get('net'), item.get('folder', default)) for item in value])
+                rules.append(('cidr', (table, len(value) > 0)))
+            elif key == 'depending_on':
+                rules.append(('depending_on', [self._compile_depends_on(d, default) for d in value]))
+            else:
+                rules.append((None, None))
+        return default, rules
+
+    def _compile_depends_on(self, depends_on, default):
+        compiled = {}
+        if 'cidr' in depends_on:
+            self.needs_ip = True
+            net = depends_on.get('net')
+            if net:
+                network = ipaddress.ip_network(net)
+                compiled['cidr'] = (network.version, int(network.network_address), int(network.netmask))
+            else:
+                compiled['cidr'] = None
+            compiled['cidr_folder'] = depends_on.get('folder', default)
+        if 'property' in depends_on:
+            compiled['property'] = depends_on.get('property').split('__')
+        if 'custom_field' in depends_on:
+            compiled['custom_field'] = depends_on.get('custom_field')
+        if 'tag' in depends_on:
+            compiled['tag'] = depends_on.get('tag')
+        compiled['value'] = depends_on.get('value')
+        compiled['folder'] = depends_on.get('folder')
+        return compiled
+
+    def get_folder_name(self, properties):
+        sot_cf_list = properties.get('custom_field_data',{})
+        hostname = properties.get('hostname')
+
+        if 'checkmk_folder' in sot_cf_list and len(sot_cf_list['checkmk_folder']) > 0:
+            # if the custom field checkmk_folder is set in our SOT we use this field
+            logger.debug(f'folder of {hostname}: {sot_cf_list["checkmk_folder"]}')
+            return sot_cf_list["checkmk_folder"]
+        if self.parts is None:
+            logger.debug(f'folder of {hostname}: {self.template}')
+            return self.template
+
+        # the primary IP is parsed only once per device
+        ip = None
+        if self.needs_ip:
+            p_ip = properties.get('primary_ip4')
+            address = p_ip.get('address') if p_ip else None
+            ip = parse_ip(address.split('/')[0]) if address else None
+
+        folder = []
+        for default, rules in self.parts:
+            fldr = None
+            for kind, rule in rules:
+                if kind == 'custom_field':
+                    cf_name, cf_key = rule
+                    fldr = sot_cf_list.get(cf_key)
+                    if fldr is None:
+                        logger.error(f'custom field {cf_name} not found in custom_field_data, using default')
+                        fldr = default
+                elif kind == 'property':
+                    fldr = get_value(properties, rule)
+                elif kind == 'cidr':
+                    table, has_nets = rule
+                    fldr = None
+                    if has_nets:
+                        if ip is None:
+                            logger.error(f'{hostname} has no primary IP!!!')
+                            fldr = default
+                        else:
+                            found, value = table.lookup(ip)
+                            if found:
+                                fldr = value
+                elif kind == 'depending_on':
+                    fldr = self._depending_on(rule, properties, sot_cf_list, ip, hostname, default, fldr)
+                if fldr is None:
+                    fldr = default
+
+            # check if we have to replace the fldr; eg. cf__xxx to the value of the custom field xxx
+            if isinstance(fldr, str) and 'cf__' in fldr:
+                cf = fldr.split('cf__')[1]
+                fldr = sot_cf_list.get(cf)
+            elif isinstance(fldr, str) and 'prop__' in fldr:
+                prop = fldr.split('__')
+                # cut of the prop__ at the beginning!
+                fldr = get_value(properties, prop[1:])
+
+            if fldr is not None and fldr != 'None':
+                if isinstance(fldr, int):
+                    fldr = str(fldr)
+                folder.append(fldr)
+
+        logger.debug(f'folder of {hostname}: {folder}')
+        return "~" + '~'.join(folder)
+
+    def _depending_on(self, rules, properties, sot_cf_list, ip, hostname, default, fldr):
+        for depends_on in rules:
+            if 'cidr' in depends_on:
+                net = depends_on['cidr']
+                if net is None:
+                    continue
+                if ip is None:
+                    logger.error(f'{hostname} has no primary IP!!!')
+                    fldr = default
+                elif ip[0] == net[0] and ip[1] & net[2] == net[1]:
+                    return depends_on['cidr_folder']
+            if 'property' in depends_on:
+                value = get_value(properties, depends_on['property'])
+                if depends_on['value'] == value:
+                    return value
+            if 'custom_field' in depends_on:
+                cf = depends_on['custom_field']
+                if cf in sot_cf_list and sot_cf_list.get(cf) == depends_on['value']:
+                    return depends_on['folder']
+            if 'tag' in depends_on:
+                tag = depends_on['tag']
+                for items in properties.get('tags') or []:
+                    if tag in items.values():
+                        fldr = depends_on['folder']
+        return fldr
+
+
+def parse_ip(address):
+    """return (version, address as int) of an IP address"""
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, address), 'big')
+    except OSError:
+        pass
+    ip = ipaddress.ip_address(address)
+    return ip.version, int(ip)
+
+def get_value(values, keys):
+    if isinstance(values, list):
+        my_list = []
+        for value in values:
+            my_list.append(get_value(value.get(keys[0]), keys[1:]))
+        return my_list
+    elif isinstance(values, str):
+        return values
+    if len(keys) == 1:
+        return values.get(keys[0])
+    return get_value(values.get(keys[0]), keys[1:])
@@ -0,0 +1,52 @@
+import os
+import gzip
+import json
+import time
+from loguru import logger
+
+
+def get_all_hosts(cmk, filename, ttl=0, refresh=False):
+    """return all hosts of cmk using a local snapshot
+
+    The snapshot is a gzipped JSON file. It is used if it is younger
+    than ttl seconds. Otherwise all hosts are fetched from cmk and the
+    snapshot is written again. A ttl of 0 disables the snapshot.
+    """
+    if not ttl:
+        return cmk.get_all_hosts()
+
+    if not refresh and os.path.isfile(filename):
+        age = time.time() - os.path.getmtime(filename)
+        if age < ttl:
+            try:
+                with gzip.open(filename, 'rt') as f:
+                    hosts = json.load(f)
+                logger.info(f'using snapshot of {len(hosts)} cmk hosts ({int(age)}s old)')
+                return hosts
+            except Exception as exc:
+                logger.error(f'could not read snapshot {filename}; got exception {exc}')
+        else:
+            logger.debug(f'snapshot {filename} is {int(age)}s old; refreshing it')
+
+    hosts = cmk.get_all_hosts()
+    try:
+        tmp_filename = f'{filename}.tmp'
+        with gzip.open(tmp_filename, 'wt') as f:
+            json.dump(hosts, f)
+        os.replace(tmp_filename, filename)
+        logger.debug(f'wrote snapshot of {len(hosts)} cmk hosts to {filename}')
+    except Exception as exc:
+        logger.error(f'could not write snapshot {filename}; got exception {exc}')
+    return hosts
+
+def invalidate(filename):
+    """remove snapshot; must be called after hosts were changed in cmk"""
+    if os.path.isfile(filename):
+        logger.debug(f'removing snapshot {filename}')
+        os.remove(filename)
+
+def get_snapshot_config(checkmk_config, basedir):
+    """return filename and ttl of the snapshot"""
+    cache_config = checkmk_config.get('defaults',{}).get('cache',{})
+    filename = os.path.join(basedir, cache_config.get('filename', 'cmk_hosts.json.gz'))
+    return filename, cache_config.get('ttl', 0)
@@ -0,0 +1,51 @@
+from loguru import logger
+
+
+class HostIndex:
+    """index a list of hosts by name
+
+    sync_cmk and show_cmk have to match every SOT device against every
+    checkmk host. The index is built once per run so that each lookup
+    is a dict access instead of a scan of the whole list.
+    """
+
+    def __init__(self, hosts=None, name=None):
+        self._get_name = name
+        self.by_name = {}
+        for host in hosts or []:
+            self.add(host)
+
+    def add(self, host):
+        hostname = self._get_name(host)
+        if hostname is None:
+            return
+        if hostname in self.by_name:
+            logger.debug(f'host {hostname} is listed twice; using last entry')
+        self.by_name[hostname] = host
+
+    def get(self, hostname, default=None):
+        return self.by_name.get(hostname, default)
+
+    def __contains__(self, hostname):
+        return hostname in self.by_name
+
+    def __len__(self):
+        return len(self.by_name)
+
+    def __iter__(self):
+        return iter(self.by_name.values())
+
+
+def cmk_hostname(host):
+    return host.get('host_name')
+
+def sot_hostname(device):
+    return device.get('hostname')
+
+def cmk_index(hosts):
+    """return index of the hosts returned by cmk.get_all_hosts()"""
+    return HostIndex(hosts, name=cmk_hostname)
+
+def sot_index(devices):
+    """return index of the devices returned by sot.select()"""
+    return HostIndex(devices, name=sot_hostname)
@@ -13,8 +13,12 @@ from veritas.tools import tools
 from veritas.checkmk import checkmk
 from veritas.sot import sot as sot
 
+# local
+import host_index
+import host_cache
 
-def show(sot, checkmk_config, args):
+
+def show(sot, checkmk_config, args, basedir):
     cmk = checkmk.Checkmk(sot=sot, 
                           url=checkmk_config.get('check_mk',{}).get('url'),
                           site=checkmk_config.get('check_mk',{}).get('site'),
@@ -34,11 +38,13 @@ def show(sot, checkmk_config, args):
         sot_devicelist = sot.select('hostname, primary_ip4, location, custom_fields') \
                             .using('nb.devices') \
                             .where()
-        cmk_devicelist = cmk.get_all_hosts()
+        snapshot, ttl = host_cache.get_snapshot_config(checkmk_config, basedir)
+        cmk_devicelist = host_cache.get_all_hosts(cmk, snapshot, ttl, args.no_cache)
         print(f'sot: {len(sot_devicelist)} cmk {len(cmk_devicelist)}')
+        cmk_hosts = host_index.cmk_index(cmk_devicelist)
         for device in sot_devicelist:
             hostname = device.get('hostname')
-            if not any(d['host_name'] == hostname for d in cmk_devicelist):
+            if hostname not in cmk_hosts:
                 print(hostname)
 
     elif args.rules:
@@ -130,7 +136,8 @@ def show(sot, checkmk_config, args):
             data = response.json()
             print(f'status {response.status_code} detail: {data["detail"]}')
     elif args.no_services:
-        devices = cmk.get_all_hosts()
+        snapshot, ttl = host_cache.get_snapshot_config(checkmk_config, basedir)
+        devices = host_cache.get_all_hosts(cmk, snapshot, ttl, args.no_cache)
         hosts_with_no_services = []
         for device in devices:
             hostname = device.get('host_name')
@@ -184,6 +191,7 @@ if __name__ == "__main__":
     parser.add_argument('--folder', type=str, required=False, help="show folder")
     parser.add_argument('--no-services', action='store_true', required=False, help="show hosts without services")
     parser.add_argument('--services', type=str, required=False, help="show services")
+    parser.add_argument('--no-cache', action='store_true', required=False, help="do not use the snapshot of the cmk hosts")
 
     # parse arguments
     args = parser.parse_args()
@@ -210,4 +218,4 @@ if __name__ == "__main__":
                   ssl_verify=cmk_config['sot'].get('ssl_verify', False),
                   url=cmk_config['sot']['nautobot'])
 
-    show(sot, cmk_config, args)
+    show(sot, cmk_config, args, BASEDIR)
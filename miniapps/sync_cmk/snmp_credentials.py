@@ -0,0 +1,88 @@
+import yaml
+import hashlib
+from types import MappingProxyType
+from loguru import logger
+
+import veritas.repo
+
+
+class SnmpCredentials:
+    """SNMP credentials read from our repo
+
+    Each credential is normalised once when the repo is read so that
+    resolving the credentials of a device is a single dict lookup. The
+    normalised credentials are read-only; get() returns a copy that the
+    caller may modify or send to checkmk.
+
+    refresh() reads the credentials again if the file in our repo has
+    changed. This way long running callers get rotated credentials.
+    """
+
+    def __init__(self, name_of_repo, path_to_repo, filename):
+        self.name_of_repo = name_of_repo
+        self.path_to_repo = path_to_repo
+        self.filename = filename
+        self.checksum = None
+        self.credentials = None
+
+    def refresh(self):
+        # the repository wrapper does not expose the hash of its commit; the
+        # credentials are parsed again if the checksum of the file has changed
+        try:
+            repo = veritas.repo.Repository(repo=self.name_of_repo, path=self.path_to_repo)
+            snmp_credentials_text = repo.get(self.filename)
+        except Exception as exc:
+            snmp_credentials_text = None
+            logger.error(f'could not read SNMP credentials from REPO {self.name_of_repo}; got exception {exc}')
+        if snmp_credentials_text is None:
+            logger.error(f'got no SNMP credentials from REPO {self.name_of_repo} FILE {self.filename}')
+            if self.credentials is None:
+                self.credentials = MappingProxyType({})
+            return
+        checksum = hashlib.sha256(snmp_credentials_text.encode()).hexdigest()
+        if self.credentials is not None and checksum == self.checksum:
+            return
+        logger.debug(f'loading SNMP credentials from REPO {self.name_of_repo} FILE {self.filename}')
+        credentials = {}
+        for cred in yaml.safe_load(snmp_credentials_text).get('snmp',[]):
+            credentials[cred.get('id')] = MappingProxyType(normalise(cred))
+        self.credentials = MappingProxyType(credentials)
+        self.checksum = checksum
+
+    def get(self, snmp_id):
+        if self.credentials is None:
+            self.refresh()
+        if snmp_id == 'unknown':
+            logger.debug('this host has "unknown" SNMP-credentials')
+            return {}
+        snmp = self.credentials.get(snmp_id)
+        if not snmp:
+            logger.debug('found no SNMP-Credentials for host')
+            return {}
+        return dict(snmp)
+
+
+def normalise(cred):
+    """return credential the way checkmk needs it"""
+    snmp = dict(cred)
+    # we use a security group to configure our devices but this
+    # group is not needed by checkmk
+    if 'security_group' in snmp:
+        del snmp['security_group']
+    snmp_version = cred.get('version')
+    if snmp_version == '1' or snmp_version == '2c':
+        snmp['type'] = "v1_v2_community"
+        del snmp['id']
+        del snmp['version']
+    elif snmp_version == 3:
+        # rename value of auth_protocol
+        # HMAC-SHA1-96 => SHA-1-96
+        if 'privacy_protocol' in snmp and '256' in snmp['privacy_protocol']:
+            # checkmk does not support AES-256
+            return {}
+        snmp['auth_protocol'] = snmp['auth_protocol'].replace('HMAC-','')
+        snmp['auth_protocol'] = snmp['auth_protocol'].replace('SHA1','SHA-1')
+        snmp['auth_protocol'] = snmp['auth_protocol'].replace('SHA2','SHA-2')
+        del snmp['id']
+        del snmp['version']
+    return snmp
@@ -1,42 +1,38 @@
 #!/usr/bin/env python
 
 import argparse
-import yaml
 import tabulate
 import urllib3
-import ipaddress
 import os
 import sys
 from loguru import logger
 
 import veritas.logging
-import veritas.repo
 from veritas.tools import tools
 from veritas.sot import sot as veritas_sot
 from veritas.checkmk import checkmk
 
+# local
+import host_index
+import folder_rules
+import update_engine
+import diff_engine
+import host_cache
+import watermark
+import snmp_credentials
 
-snmp_credentials = None
 
-def add_new_hosts(args, sot, checkmk_config):
+snmp_resolver = None
+folder_rules_cache = None
+
+def add_new_hosts(args, sot, cmk, cmk_hosts, sot_devices, checkmk_config):
     """add new hosts to cmk"""
     nn_of_devices_to_be_added = 0
     devices_to_be_added = []
 
-    cmk = checkmk.Checkmk(sot=sot, 
-                          url=checkmk_config.get('check_mk',{}).get('url'),
-                          site=checkmk_config.get('check_mk',{}).get('site'),
-                          username=checkmk_config.get('check_mk',{}).get('username'),
-                          password=checkmk_config.get('check_mk',{}).get('password'))
-
-    all_cmk_devices = cmk.get_all_hosts()
-    all_sot_devices = sot.select('hostname, primary_ip4, location, custom_field_data') \
-                         .using('nb.devices') \
-                         .where(args.devices)
-
-    for device_properties in all_sot_devices:
+    for device_properties in sot_devices:
         sot_device_name = device_properties.get('hostname')
-        device_cmk_properties = next((item for item in all_cmk_devices if item['host_name'] == sot_device_name), {})
+        device_cmk_properties = cmk_hosts.get(sot_device_name, {})
         
         # check if device is in cmk
         if len(device_cmk_properties) == 0:
@@ -52,8 +48,9 @@ def add_new_hosts(args, sot, checkmk_config):
                 nn_of_devices_to_be_added += 1
                 devices_to_be_added.append(sot_dev_config)
     
+    added = set()
     if args.dry_run:
-        print(f'{nn_of_devices_to_be_added}/{len(all_sot_devices)} devices are new')
+        print(f'{nn_of_devices_to_be_added}/{len(sot_devices)} devices are new')
         for d in devices_to_be_added:
             print(d)
     else:
@@ -66,109 +63,74 @@ def add_new_hosts(args, sot, checkmk_config):
         if args.no_bulk:
             for d in device_list:
                 success = cmk.add_hosts([d])
-                result.append({'host': d['hostname'], 'success': success})
+                result.append({'host': d['host_name'], 'success': success})
+                if success:
+                    added.add(d['host_name'])
             tab = tabulate.tabulate(result, headers="keys")
             print(tab)
         else:
             success = cmk.add_hosts(device_list)
             if success:
                 print(f'added {len(device_list)} devices to cmk')
+                added.update(d['host_name'] for d in device_list)
             else:
                 print('could not add devices to cmk')
 
-def remove_hosts(args, sot, checkmk_config):
+    return added
+
+def remove_hosts(args, sot, cmk, cmk_hosts, sot_devices, checkmk_config):
     """remove hosts in cmk"""
     nn_of_devices_to_be_removed = 0
     devices_to_be_removed = []
 
-    cmk = checkmk.Checkmk(sot=sot, 
-                          url=checkmk_config.get('check_mk',{}).get('url'),
-                          site=checkmk_config.get('check_mk',{}).get('site'),
-                          username=checkmk_config.get('check_mk',{}).get('username'),
-                          password=checkmk_config.get('check_mk',{}).get('password'))
-
-    all_cmk_devices = cmk.get_all_hosts()
-    all_sot_devices = sot.select('hostname, primary_ip4, location, custom_field_data') \
-                         .using('nb.devices') \
-                         .where(args.devices)
-
-    for device_properties in all_cmk_devices:
-        # check if device is in cmk
+    for device_properties in cmk_hosts:
+        # check if device is in sot
         hostname = device_properties.get('host_name')
-        if not any(d['hostname'] == hostname for d in all_sot_devices):
+        if hostname not in sot_devices:
             logger.debug(f'{hostname} found in cmk but not in sot; removing it')
             nn_of_devices_to_be_removed += 1
             devices_to_be_removed.append(hostname)
     
     if args.dry_run:
-        print(f'{nn_of_devices_to_be_removed}/{len(all_sot_devices)} devices found in cmk but not in sot')
+        print(f'{nn_of_devices_to_be_removed}/{len(sot_devices)} devices found in cmk but not in sot')
         for d in devices_to_be_removed:
             print(d)
 
-def update_hosts(args, sot, checkmk_config):
-    """sync sot with cmk"""
+def update_hosts(args, sot, cmk, cmk_hosts, pages, checkmk_config):
+    """sync sot with cmk and return the hosts that are in sync
+
+    pages is a list of lists of sot devices. In streaming mode it is an
+    iterator and each page is updated before the next page is read.
+    """
+    synced = set()
+    nn_of_devices = 0
     nn_of_devices_to_be_updated = 0
     nn_of_new_hosts = 0
     nn_of_success = 0
     nn_of_failed = 0
-    devices_to_be_updated = []
-
-    cmk = checkmk.Checkmk(sot=sot, 
-                          url=checkmk_config.get('check_mk',{}).get('url'),
-                          site=checkmk_config.get('check_mk',{}).get('site'),
-                          username=checkmk_config.get('check_mk',{}).get('username'),
-                          password=checkmk_config.get('check_mk',{}).get('password'))
-
-    all_cmk_devices = cmk.get_all_hosts()
-    all_sot_devices = sot.select('hostname, primary_ip4, location, custom_field_data') \
-                         .using('nb.devices') \
-                         .where(args.devices)
-
-    for device_properties in all_sot_devices:
-        sot_device_name = device_properties.get('hostname')
-        device_cmk_properties = next((item for item in all_cmk_devices if item['host_name'] == sot_device_name), {})
-        
-        # check if device is in cmk
-        if len(device_cmk_properties) == 0:
-            logger.info(f'device {sot_device_name} not found in cmk')
-            nn_of_new_hosts += 1
-            continue
-
-        sot_dev_config, cmk_dev_config = get_current_device_configs(sot, 
-                                                            device_properties, 
-                                                            device_cmk_properties,
-                                                            checkmk_config)
-
-        attributes, htg, remove_attributes, folder = get_new_cmk_device_config(sot_dev_config, cmk_dev_config)
-        if attributes or htg or remove_attributes or folder:
-            nn_of_devices_to_be_updated += 1
-            new_properties = {'host': device_properties['hostname'],
-                              'attributes': attributes,
-                              'remove_attributes': remove_attributes,
-                              'htg': htg,
-                              'folder': folder}
-
-            if not args.dry_run:
-                etag = cmk.get_etag(device_properties['hostname'])
-                res_folder = res_update = True
-                if folder:
-                    res_folder = cmk.move_host_to_folder(device_properties['hostname'], etag, folder)
-                if attributes or htg or remove_attributes:
-                    res_update = cmk.update_host_in_cmk(device_properties['hostname'], etag, attributes, remove_attributes)
-                success = res_folder and res_update
-                new_properties.update({'success': success})
-                if success:
-                    nn_of_success += 1
-                else:
-                    nn_of_failed += 1
-
-            devices_to_be_updated.append(new_properties)
 
+    update_config = checkmk_config.get('defaults', {}).get('update', {})
+    threads = args.threads or update_config.get('threads', 4)
+    retries = update_config.get('retries', 2)
+    batch_size = 0 if args.no_bulk else update_config.get('batch_size', 500)
+
+    for nn_of_page_devices, new_hosts, in_sync, devices_to_be_updated in iter_changes(args, sot, cmk_hosts, pages, checkmk_config):
+        nn_of_devices += nn_of_page_devices
+        nn_of_new_hosts += new_hosts
+        nn_of_devices_to_be_updated += len(devices_to_be_updated)
+        synced.update(in_sync)
+
+        if not args.dry_run:
+            update_engine.update_hosts(cmk, devices_to_be_updated, threads, retries, batch_size)
+            success = sum(1 for d in devices_to_be_updated if d['success'])
+            synced.update(d['host'] for d in devices_to_be_updated if d['success'])
+            nn_of_success += success
+            nn_of_failed += len(devices_to_be_updated) - success
+
+        if len(devices_to_be_updated) > 0:
+            tab = tabulate.tabulate(devices_to_be_updated, headers="keys")
+            print(tab)
 
-    if nn_of_devices_to_be_updated > 0:
-        devices_to_be_updated[0].keys()
-        tab = tabulate.tabulate(devices_to_be_updated, headers="keys")
-        print(tab)
     if nn_of_new_hosts > 0:
         print(f'there are {nn_of_new_hosts} hosts found in SOT; please add those hosts')
         # the result is written to the database
@@ -180,9 +142,9 @@ def update_hosts(args, sot, checkmk_config):
         logger.bind(result=result).journal(f'there are {nn_of_new_hosts} hosts found in SOT; please add those hosts')
 
     if args.dry_run:
-        print(f'{nn_of_devices_to_be_updated}/{len(all_sot_devices)} devices to be updated')
+        print(f'{nn_of_devices_to_be_updated}/{nn_of_devices} devices to be updated')
     else:
-        print(f'{nn_of_devices_to_be_updated}/{len(all_sot_devices)} were to be updated')
+        print(f'{nn_of_devices_to_be_updated}/{nn_of_devices} were to be updated')
         print(f'success: {nn_of_success} failed: {nn_of_failed}')
         # the result is written to the database
         result = {'app': 'sync_cmk',
@@ -192,6 +154,56 @@ def update_hosts(args, sot, checkmk_config):
                     }
         logger.bind(result=result).journal(f'success: {nn_of_success} failed: {nn_of_failed}')
 
+    return synced
+
+def iter_changes(args, sot, cmk_hosts, pages, checkmk_config):
+    """yield number of devices, number of new hosts, hosts in sync and changes of each page"""
+    diff_config = checkmk_config.get('defaults', {}).get('diff', {})
+    processes = args.processes or diff_config.get('processes', 1)
+    chunk_size = diff_config.get('chunk_size', 1000)
+
+    for sot_devices in pages:
+        nn_of_new_hosts = 0
+        in_sync = []
+        devices_to_be_updated = []
+        pairs = []
+        for device_properties in sot_devices:
+            sot_device_name = device_properties.get('hostname')
+            device_cmk_properties = cmk_hosts.get(sot_device_name, {})
+            
+            # check if device is in cmk
+            if len(device_cmk_properties) == 0:
+                logger.info(f'device {sot_device_name} not found in cmk')
+                nn_of_new_hosts += 1
+                continue
+            pairs.append((device_properties, device_cmk_properties))
+
+        # the diff is computed in the same way if --dry-run is used
+        changes = diff_engine.compute_changes(sot, pairs, checkmk_config, diff_device, processes, chunk_size)
+        for (device_properties, device_cmk_properties), new_properties in zip(pairs, changes):
+            if new_properties:
+                devices_to_be_updated.append(new_properties)
+            else:
+                in_sync.append(device_properties.get('hostname'))
+
+        yield len(sot_devices), nn_of_new_hosts, in_sync, devices_to_be_updated
+
+def diff_device(sot, device_sot_properties, device_cmk_properties, check_mk_config):
+    """return the changes of a host or None if the host is in sync"""
+    sot_dev_config, cmk_dev_config = get_current_device_configs(sot, 
+                                                                device_sot_properties, 
+                                                                device_cmk_properties,
+                                                                check_mk_config)
+
+    attributes, htg, remove_attributes, folder = get_new_cmk_device_config(sot_dev_config, cmk_dev_config)
+    if attributes or htg or remove_attributes or folder:
+        return {'host': device_sot_properties['hostname'],
+                'attributes': attributes,
+                'remove_attributes': remove_attributes,
+                'htg': htg,
+                'folder': folder}
+    return None
+
 def get_current_device_configs(sot, device_sot_properties, device_cmk_properties, check_mk_config):
     """return difference between sot config and checkmk config of a host"""
     sot_config = {}
@@ -355,6 +367,82 @@ def get_new_cmk_device_config(sot_dev_config, cmk_dev_config):
 # internal methods
 #
 
+def get_cmk(sot, checkmk_config):
+    """return checkmk object"""
+    return checkmk.Checkmk(sot=sot, 
+                           url=checkmk_config.get('check_mk',{}).get('url'),
+                           site=checkmk_config.get('check_mk',{}).get('site'),
+                           username=checkmk_config.get('check_mk',{}).get('username'),
+                           password=checkmk_config.get('check_mk',{}).get('password'))
+
+def get_sot_devices(args, sot, incremental=False):
+    """return index of all sot devices"""
+    select = 'hostname, primary_ip4, location, custom_field_data'
+    if incremental:
+        select += ', last_updated'
+    all_sot_devices = sot.select(select) \
+                         .using('nb.devices') \
+                         .where(args.devices)
+    logger.debug(f'building index of {len(all_sot_devices)} sot devices')
+    return host_index.sot_index(all_sot_devices)
+
+def iter_sot_devices(args, sot, page_size):
+    """yield pages of sot devices; only one page is kept in memory"""
+    offset = 0
+    while True:
+        devices = sot.select('hostname, primary_ip4, location, custom_field_data') \
+                     .using('nb.devices') \
+                     .set(limit=page_size, offset=offset) \
+                     .where(args.devices)
+        if len(devices) == 0:
+            break
+        logger.debug(f'got {len(devices)} sot devices (offset {offset})')
+        yield devices
+        offset += len(devices)
+
+def get_cmk_hosts(args, cmk, snapshot, ttl):
+    """return index of all cmk hosts"""
+    all_cmk_devices = host_cache.get_all_hosts(cmk, snapshot, ttl, args.no_cache)
+    logger.debug(f'building index of {len(all_cmk_devices)} cmk hosts')
+    return host_index.cmk_index(all_cmk_devices)
+
+def get_changed_devices(sot, sot_devices, wm, checkmk_config):
+    """return devices that have changed since the last sync and their fingerprints
+
+    The config of a device is only computed if its last_updated timestamp
+    has changed or if the settings used to compute the config have changed.
+    """
+    changed = []
+    fingerprints = {}
+    settings = get_settings_fingerprint(checkmk_config)
+    settings_changed = wm.settings != settings
+    if settings_changed:
+        logger.info('the settings have changed since the last sync; checking all devices')
+    for device_properties in sot_devices:
+        hostname = device_properties.get('hostname')
+        last_updated = device_properties.get('last_updated')
+        if not settings_changed and not wm.has_changed(hostname, last_updated):
+            continue
+        sot_dev_config, x = get_current_device_configs(sot, device_properties, {}, checkmk_config)
+        fingerprint = watermark.fingerprint(sot_dev_config)
+        if wm.has_changed(hostname, last_updated, fingerprint):
+            changed.append(device_properties)
+            fingerprints[hostname] = fingerprint
+        else:
+            # the settings have changed but not the config of this device
+            wm.update(hostname, last_updated, fingerprint)
+    wm.settings = settings
+    logger.info(f'{len(changed)}/{len(sot_devices)} devices have changed since {wm.last_sync}')
+    return host_index.sot_index(changed), fingerprints
+
+def get_settings_fingerprint(checkmk_config):
+    """return fingerprint of the settings used by get_current_device_configs"""
+    return watermark.fingerprint({
+        'mappings': checkmk_config.get('mappings'),
+        'custom_fields': checkmk_config.get('custom_fields'),
+        'folders': checkmk_config.get('folders',{}).get('structure'),
+        'snmp': get_snmp_resolver(checkmk_config).checksum})
+
 def prepare_device_list(devices):
     """prepare device list so that the list can be used to add devices to cmk"""
     entries = []
@@ -392,56 +480,17 @@ def get_attributes(device):
     return attributes
 
 def get_snmp_credentials(sot, device_properties, check_mk_config):
-    global snmp_credentials
-    snmp = {}
     snmp_id = device_properties.get('custom_field_data',{}).get('snmp_credentials')
+    return get_snmp_resolver(check_mk_config).get(snmp_id)
 
-    name_of_repo = check_mk_config.get('credentials',{}).get('snmp',{}).get('repo')
-    path_to_repo = check_mk_config.get('credentials',{}).get('snmp',{}).get('path')
-    filename = check_mk_config.get('credentials',{}).get('snmp',{}).get('filename')
-
-    if snmp_credentials is None:
-        # open repo
-        repo = veritas.repo.Repository(repo=name_of_repo, path=path_to_repo)
-        # get SNMP credentials from SOT
-        logger.debug(f'loading SNMP credentials from REPO {name_of_repo} FILE {filename}')
-        snmp_credentials_text = repo.get(filename)
-        snmp_credentials = yaml.safe_load(snmp_credentials_text).get('snmp',[])
-
-    if snmp_id == 'unknown':
-        logger.debug('this host has "unknown" SNMP-credentials')
-        return {}
-
-    for cred in snmp_credentials:
-        if cred.get('id') == snmp_id:
-            snmp = dict(cred)
-            # we use a security group to configure our devices but this 
-            # group is not needed by checkmk
-            if 'security_group' in snmp:
-                del snmp['security_group']
-            logger.debug(f'found SNMP credentials id:{snmp_id}')
-            snmp_version = cred.get('version')
-            if snmp_version == '1' or snmp_version == '2c':
-                snmp['type'] = "v1_v2_community"
-                del snmp['id']
-                del snmp['version']
-                
-            elif snmp_version == 3:
-                # rename value of auth_protocol
-                # HMAC-SHA1-96 => SHA-1-96
-                if 'privacy_protocol' in snmp and '256' in snmp['privacy_protocol']:
-                    #logger.debug(f'checkmk does not support AES-256')
-                    return {}
-                snmp['auth_protocol'] = snmp['auth_protocol'].replace('HMAC-','')
-                snmp['auth_protocol'] = snmp['auth_protocol'].replace('SHA1','SHA-1')
-                snmp['auth_protocol'] = snmp['auth_protocol'].replace('SHA2','SHA-2')
-                del snmp['id']
-                del snmp['version']
-
-    if len(snmp) == 0:
-        logger.debug('found no SNMP-Credentials for host')
-
-    return snmp
+def get_snmp_resolver(check_mk_config):
+    global snmp_resolver
+    if snmp_resolver is None:
+        snmp_resolver = snmp_credentials.SnmpCredentials(
+            name_of_repo=check_mk_config.get('credentials',{}).get('snmp',{}).get('repo'),
+            path_to_repo=check_mk_config.get('credentials',{}).get('snmp',{}).get('path'),
+            filename=check_mk_config.get('credentials',{}).get('snmp',{}).get('filename'))
+    return snmp_resolver
 
 def get_cfield_from_sot(properties, tagfield, seperator, key_prefix):
     response = {}
@@ -459,112 +508,14 @@ def get_cfield_from_sot(properties, tagfield, seperator, key_prefix):
     return response
 
 def get_folder_name(properties, folder_config):
-    sot_cf_list = properties.get('custom_field_data',{})
-    sot_tags = properties.get('tags')
-    hostname = properties.get('hostname')
-    folders = []
-    fldrs = folder_config.get('template')
-    if 'checkmk_folder' in sot_cf_list and len(sot_cf_list['checkmk_folder']) > 0:
-        # if the custom field checkmk_folder is set in our SOT we use this field
-        logger.debug(f'folder of {hostname}: {sot_cf_list["checkmk_folder"]}')
-        return sot_cf_list["checkmk_folder"]
-    elif '~' in fldrs:
-        folders = fldrs.split('~')
-    else:
-        logger.debug(f'folder of {hostname}: {fldrs}')
-        return fldrs
-
-    folder = []
-    for item in folders:
-        # item is part of the path eg folder1 if path is folder1~folder2~folder3
-        config = folder_config.get(item)
-        default = config.get('default')
-        fldr = None
-        for key, value in config.items():
-            if key == 'custom_field':
-                fldr = sot_cf_list.get(value.replace('cf_',''))
-                if fldr is None:
-                    logger.error(f'custom field {value} not found in custom_field_data, using default')
-                    fldr = default
-            if key == 'property':
-                vls = value.split('__')
-                fldr = get_value(properties, vls)
-            if key == 'cidr':
-                fldr = None
-                for item in value:
-                    net = item.get('net')
-                    p_ip = properties.get('primary_ip4',{})
-                    ip = p_ip.get('address') if p_ip else None
-                    if ip is None:
-                        logger.error(f'{hostname} has no primary IP!!!')
-                        fldr = default
-                    else:
-                        if ipaddress.ip_address(ip.split('/')[0]) in ipaddress.ip_network(net):
-                            fldr = item.get('folder', default)
-            if key == 'depending_on':
-                for depends_on in value:
-                    if 'cidr' in depends_on:
-                        net = depends_on.get('net')
-                        if not net:
-                            continue
-                        ip = None if not properties['primary_ip4'] else properties.get('primary_ip4',{}).get('address')
-                        if ip is None:
-                            logger.error(f'{hostname} has no primary IP!!!')
-                            fldr = default
-                        else:
-                            if ipaddress.ip_address(ip.split('/')[0]) in ipaddress.ip_network(net):
-                                fldr = depends_on.get('folder', default)
-                                break
-                    if 'property' in depends_on:
-                        vls = depends_on.get('property').split('__')
-                        value = get_value(properties, vls)
-                        if depends_on.get('value') == value:
-                            fldr = value
-                            break
-                    if 'custom_field' in depends_on:
-                        cf = depends_on.get('custom_field')
-                        if cf in sot_cf_list:
-                            if sot_cf_list.get(cf) == depends_on.get('value'):
-                                fldr = depends_on.get('folder')
-                                break
-                    if 'tag' in depends_on:
-                        tag = depends_on.get('tag')
-                        for items in sot_tags:
-                            for k,v in items.items():
-                                if tag == v:
-                                    fldr = depends_on.get('folder')
-                                    break
-
-            if fldr is None:
-                fldr = default
-        # check if we have to replace the fldr; eg. cf__xxx to the value of the custom field xxx
-        if 'cf__' in fldr:
-            cf = fldr.split('cf__')[1]
-            fldr = sot_cf_list.get(cf)
-        elif 'prop__' in fldr:
-            prop = fldr.split('__')
-            # cut of the prop__ at the beginning!
-            fldr = get_value(properties, prop[1:])
-
-        if fldr is not None and fldr != 'None':
-            if isinstance(fldr, int):
-                fldr = str(fldr)
-            folder.append(fldr)
-
-    logger.debug(f'folder of {hostname}: {folder}')
-    return "~" + '~'.join(folder)
-
-def get_value(values, keys):
-    if isinstance(values, list):
-        my_list = []
-        for value in values:
-            my_list.append(get_value(value.get(keys[0]), keys[1:]))
-        return my_list
-    elif isinstance(values, str):
-        return values
-    if len(keys) == 1:
-        return values.get(keys[0])
-    return get_value(values.get(keys[0]), keys[1:])
+    """return folder of the device
+
+    The folder config is compiled once and reused for all devices.
+    """
+    global folder_rules_cache
+    if folder_rules_cache is None or folder_rules_cache[0] is not folder_config:
+        folder_rules_cache = (folder_config, folder_rules.FolderRules(folder_config))
+    return folder_rules_cache[1].get_folder_name(properties)
 
 def main(args_list=None):
 
@@ -587,7 +538,12 @@ def main(args_list=None):
     parser.add_argument('--add-hosts', action='store_true', help='Add missing devices to checkmk')
     parser.add_argument('--remove-hosts', action='store_true', help='Remove devices from checkmk')
     parser.add_argument('--dry-run', action='store_true', help='Just print what to do')
-    parser.add_argument('--no-bulk', action='store_true', help='add host using a single bulk request')
+    parser.add_argument('--no-bulk', action='store_true', help='add and update hosts one by one instead of using bulk requests')
+    parser.add_argument('--threads', type=int, required=False, help='number of threads used to update hosts')
+    parser.add_argument('--processes', type=int, required=False, help='number of processes used to compute the diff')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the snapshot of the cmk hosts')
+    parser.add_argument('--stream', action='store_true', help='read and update devices page by page')
+    parser.add_argument('--incremental', action='store_true', help='sync only devices that have changed since the last incremental sync')
 
     # parse arguments
     if args_list:
@@ -617,12 +573,80 @@ def main(args_list=None):
                           url=check_mk_config['sot']['nautobot'],
                           ssl_verify=check_mk_config['sot'].get('ssl_verify', False))
 
+    if not args.update_hosts and not args.add_hosts and not args.remove_hosts:
+        return
+
+    # (re)load SNMP credentials if our repo has changed since the last run
+    # the credentials are loaded before worker processes are started
+    get_snmp_resolver(check_mk_config).refresh()
+
+    if args.stream and args.incremental:
+        print('--stream cannot be combined with --incremental')
+        return
+
+    # get all hosts once and use the same index for all sync modes
+    cmk = get_cmk(sot, check_mk_config)
+    snapshot, ttl = host_cache.get_snapshot_config(check_mk_config, BASEDIR)
+
+    if args.stream:
+        # the devices are read and synced page by page; only the index
+        # of our cmk hosts is kept in memory
+        page_size = check_mk_config.get('defaults',{}).get('stream',{}).get('page_size', 500)
+        cmk_hosts = get_cmk_hosts(args, cmk, snapshot, ttl)
+        if args.update_hosts:
+            update_hosts(args, sot, cmk, cmk_hosts, iter_sot_devices(args, sot, page_size), check_mk_config)
+        if args.add_hosts or args.remove_hosts:
+            logger.info('--stream is only used to update hosts; adding and removing hosts reads all devices')
+            all_sot_devices = get_sot_devices(args, sot)
+            if args.add_hosts:
+                add_new_hosts(args, sot, cmk, cmk_hosts, all_sot_devices, check_mk_config)
+            if args.remove_hosts:
+                remove_hosts(args, sot, cmk, cmk_hosts, all_sot_devices, check_mk_config)
+        if not args.dry_run and (args.update_hosts or args.add_hosts):
+            host_cache.invalidate(snapshot)
+        return
+
+    all_sot_devices = get_sot_devices(args, sot, args.incremental)
+
+    if args.incremental:
+        # only devices whose last_updated or computed config has changed
+        # are synced. Changes made in checkmk itself are not detected; 
+        # run without --incremental to get a full reconciliation
+        filename = check_mk_config.get('defaults',{}) \
+                                  .get('incremental',{}) \
+                                  .get('watermark', 'sync_cmk.watermark.json')
+        wm = watermark.Watermark(os.path.join(BASEDIR, filename))
+        sot_devices, fingerprints = get_changed_devices(sot, all_sot_devices, wm, check_mk_config)
+        if len(sot_devices) == 0 and not args.remove_hosts:
+            print('no device has changed since the last sync')
+            return
+    else:
+        sot_devices = all_sot_devices
+
+    cmk_hosts = get_cmk_hosts(args, cmk, snapshot, ttl)
+
+    synced = set()
     if args.update_hosts:
-        update_hosts(args, sot, check_mk_config)
+        synced.update(update_hosts(args, sot, cmk, cmk_hosts, [sot_devices], check_mk_config))
     if args.add_hosts:
-        add_new_hosts(args, sot, check_mk_config)
+        synced.update(add_new_hosts(args, sot, cmk, cmk_hosts, sot_devices, check_mk_config))
     if args.remove_hosts:
-        remove_hosts(args, sot, check_mk_config)
+        # the list of all sot devices is needed to find hosts that must be removed
+        remove_hosts(args, sot, cmk, cmk_hosts, all_sot_devices, check_mk_config)
+
+    # the snapshot of our cmk hosts is outdated if we have changed hosts
+    if not args.dry_run and (args.update_hosts or args.add_hosts):
+        host_cache.invalidate(snapshot)
+
+    if args.incremental and not args.dry_run:
+        for device_properties in sot_devices:
+            hostname = device_properties.get('hostname')
+            if hostname in synced:
+                wm.update(hostname, device_properties.get('last_updated'), fingerprints[hostname])
+            else:
+                # the host is synced again by the next run
+                wm.hosts.pop(hostname, None)
+        wm.save()
 
 if __name__ == "__main__":
     """main entry point
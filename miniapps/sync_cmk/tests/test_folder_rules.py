@@ -0,0 +1,191 @@
+import os
+import sys
+import ipaddress
+import random
+import pytest
+from loguru import logger
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import folder_rules
+
+
+def legacy_get_folder_name(properties, folder_config):
+    """get_folder_name of sync_cmk before the rules were compiled"""
+    sot_cf_list = properties.get('custom_field_data',{})
+    sot_tags = properties.get('tags')
+    hostname = properties.get('hostname')
+    folders = []
+    fldrs = folder_config.get('template')
+    if 'checkmk_folder' in sot_cf_list and len(sot_cf_list['checkmk_folder']) > 0:
+        return sot_cf_list["checkmk_folder"]
+    elif '~' in fldrs:
+        folders = fldrs.split('~')
+    else:
+        return fldrs
+
+    folder = []
+    for item in folders:
+        config = folder_config.get(item)
+        default = config.get('default')
+        fldr = None
+        for key, value in config.items():
+            if key == 'custom_field':
+                fldr = sot_cf_list.get(value.replace('cf_',''))
+                if fldr is None:
+                    fldr = default
+            if key == 'property':
+                vls = value.split('__')
+                fldr = folder_rules.get_value(properties, vls)
+            if key == 'cidr':
+                fldr = None
+                for item in value:
+                    net = item.get('net')
+                    p_ip = properties.get('primary_ip4',{})
+                    ip = p_ip.get('address') if p_ip else None
+                    if ip is None:
+                        logger.error(f'{hostname} has no primary IP!!!')
+                        fldr = default
+                    else:
+                        if ipaddress.ip_address(ip.split('/')[0]) in ipaddress.ip_network(net):
+                            fldr = item.get('folder', default)
+            if key == 'depending_on':
+                for depends_on in value:
+                    if 'cidr' in depends_on:
+                        net = depends_on.get('net')
+                        if not net:
+                            continue
+                        ip = None if not properties['primary_ip4'] else properties.get('primary_ip4',{}).get('address')
+                        if ip is None:
+                            fldr = default
+                        else:
+                            if ipaddress.ip_address(ip.split('/')[0]) in ipaddress.ip_network(net):
+                                fldr = depends_on.get('folder', default)
+                                break
+                    if 'property' in depends_on:
+                        vls = depends_on.get('property').split('__')
+                        value = folder_rules.get_value(properties, vls)
+                        if depends_on.get('value') == value:
+                            fldr = value
+                            break
+                    if 'custom_field' in depends_on:
+                        cf = depends_on.get('custom_field')
+                        if cf in sot_cf_list:
+                            if sot_cf_list.get(cf) == depends_on.get('value'):
+                                fldr = depends_on.get('folder')
+                                break
+                    if 'tag' in depends_on:
+                        tag = depends_on.get('tag')
+                        for items in sot_tags:
+                            for k,v in items.items():
+                                if tag == v:
+                                    fldr = depends_on.get('folder')
+                                    break
+
+            if fldr is None:
+                fldr = default
+        if 'cf__' in fldr:
+            cf = fldr.split('cf__')[1]
+            fldr = sot_cf_list.get(cf)
+        elif 'prop__' in fldr:
+            prop = fldr.split('__')
+            fldr = folder_rules.get_value(properties, prop[1:])
+
+        if fldr is not None and fldr != 'None':
+            if isinstance(fldr, int):
+                fldr = str(fldr)
+            folder.append(fldr)
+
+    return "~" + '~'.join(folder)
+
+
+STRUCTURE = {
+    'template': 'engine~network~location~zone',
+    'engine': {
+        'default': 'default_engine',
+        'cidr': [
+            {'net': '10.0.0.0/8', 'folder': 'ten'},
+            {'net': '10.1.0.0/16', 'folder': 'ten_one'},
+            {'net': '10.1.2.0/24', 'folder': 'ten_one_two'},
+            {'net': '192.168.0.0/16', 'folder': 'private'},
+            # the last matching net wins, a net without folder uses the default
+            {'net': '192.168.1.0/24', 'folder': 'private'},
+            {'net': '192.168.0.0/17', 'folder': 'private_low'},
+            {'net': '192.168.254.0/24'},
+        ],
+    },
+    'network': {
+        'default': 'default_network',
+        'custom_field': 'cf_net',
+    },
+    'location': {
+        'default': 'None',
+        'depending_on': [
+            {'custom_field': 'net', 'value': 'lab', 'folder': 'prop__location__name'},
+            {'custom_field': 'net', 'value': 'dmz', 'folder': 'cf__zone'},
+            {'property': 'role__name', 'value': 'core'},
+        ],
+    },
+    'zone': {
+        'default': 'no_zone',
+        'depending_on': [
+            {'cidr': True, 'net': '172.16.0.0/12', 'folder': 'rfc1918'},
+            {'tag': 'firewall', 'folder': 'fw'},
+        ],
+    },
+}
+
+
+def device(address='10.1.2.3/24', net='lab', zone='red', role='access', tags=None, checkmk_folder=''):
+    return {'hostname': 'lab.local',
+            'primary_ip4': {'address': address} if address else None,
+            'location': {'name': 'site1'},
+            'role': {'name': role},
+            'tags': tags or [],
+            'custom_field_data': {'net': net, 'zone': zone, 'checkmk_folder': checkmk_folder}}
+
+
+@pytest.mark.parametrize('properties, expected', [
+    # cidr: the last matching net wins
+    (device('10.1.2.3/24'), '~ten_one_two~lab~site1~no_zone'),
+    (device('10.1.9.3/24'), '~ten_one~lab~site1~no_zone'),
+    (device('10.200.0.1/24'), '~ten~lab~site1~no_zone'),
+    (device('192.168.0.1/24'), '~private_low~lab~site1~no_zone'),
+    (device('192.168.200.1/24'), '~private~lab~site1~no_zone'),
+    (device('192.168.254.1/24'), '~default_engine~lab~site1~no_zone'),
+    (device('8.8.8.8/32'), '~default_engine~lab~site1~no_zone'),
+    # no primary IP
+    (device(None), '~default_engine~lab~site1~no_zone'),
+    # depending_on custom_field with cf__ substitution
+    (device(net='dmz'), '~ten_one_two~dmz~red~no_zone'),
+    # depending_on property; 'None' is not added to the folder
+    (device(net='other', role='core'), '~ten_one_two~other~core~no_zone'),
+    (device(net='other'), '~ten_one_two~other~no_zone'),
+    # missing custom field uses the default
+    (device(net=None), '~ten_one_two~default_network~no_zone'),
+    # depending_on cidr and tag
+    (device('172.17.0.1/24'), '~default_engine~lab~site1~rfc1918'),
+    (device(tags=[{'name': 'firewall'}]), '~ten_one_two~lab~site1~fw'),
+    # the custom field checkmk_folder overwrites the structure
+    (device(checkmk_folder='~manual'), '~manual'),
+])
+def test_folder_name(properties, expected):
+    rules = folder_rules.FolderRules(STRUCTURE)
+    assert legacy_get_folder_name(properties, STRUCTURE) == expected
+    assert rules.get_folder_name(properties) == expected
+
+def test_template_without_parts():
+    structure = {'template': 'all_devices'}
+    rules = folder_rules.FolderRules(structure)
+    assert rules.get_folder_name(device()) == legacy_get_folder_name(device(), structure) == 'all_devices'
+
+def test_random_devices():
+    rng = random.Random(4)
+    rules = folder_rules.FolderRules(STRUCTURE)
+    for _ in range(2000):
+        address = rng.choice([None, f'10.{rng.randint(0, 255)}.{rng.randint(0, 3)}.1/24',
+                              f'172.{rng.randint(10, 40)}.0.1/24', f'192.168.{rng.randint(0, 9)}.1/24'])
+        properties = device(address,
+                            net=rng.choice(['lab', 'dmz', 'other', None]),
+                            role=rng.choice(['core', 'access']),
+                            tags=rng.choice([[], [{'name': 'firewall'}], [{'name': 'other'}]]))
+        assert rules.get_folder_name(properties) == legacy_get_folder_name(properties, STRUCTURE)
@@ -0,0 +1,121 @@
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+
+
+def update_hosts(cmk, changes, threads=4, retries=2, batch_size=0):
+    """update hosts in cmk using a pool of worker threads
+
+    changes is a list of dicts containing host, attributes, remove_attributes,
+    htg and folder. Each dict gets a 'success' key. The order of the list is
+    not changed.
+
+    If batch_size is set, attributes are updated using the bulk-update
+    endpoint of cmk. Only hosts of a rejected batch are updated one by one.
+    """
+    if len(changes) == 0:
+        return changes
+
+    logger.info(f'updating {len(changes)} hosts using {threads} threads')
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        if not batch_size:
+            results = executor.map(lambda change: update_host(cmk, change, retries), changes)
+            for change, success in zip(changes, results):
+                change['success'] = success
+            return changes
+
+        # there is no bulk endpoint to move hosts; move them one by one
+        results = executor.map(lambda change: move_host(cmk, change, retries), changes)
+        for change, success in zip(changes, results):
+            change['success'] = success
+
+        to_be_updated = [c for c in changes if c['success'] and has_attributes(c)]
+        for i in range(0, len(to_be_updated), batch_size):
+            batch = to_be_updated[i:i + batch_size]
+            if bulk_update(cmk, batch):
+                continue
+            logger.info(f'bulk update of {len(batch)} hosts failed; updating hosts one by one')
+            results = executor.map(lambda change: update_attributes(cmk, change, retries), batch)
+            for change, success in zip(batch, results):
+                change['success'] = success
+
+    return changes
+
+def update_host(cmk, change, retries=2):
+    """move host to its new folder and update its attributes"""
+    return move_host(cmk, change, retries) and update_attributes(cmk, change, retries)
+
+def move_host(cmk, change, retries=2):
+    """move host to its new folder"""
+    hostname = change['host']
+    if not change.get('folder'):
+        return True
+    try:
+        return _with_etag(cmk, hostname, retries,
+                          lambda etag: cmk.move_host_to_folder(hostname, etag, change['folder']))
+    except Exception as exc:
+        logger.error(f'could not move {hostname}; got exception {exc}')
+        return False
+
+def update_attributes(cmk, change, retries=2):
+    """update attributes of a single host
+
+    Each update needs the current ETag of the host. The lib only returns
+    True or False, so a failed update is retried with a fresh ETag. This
+    covers the 412 (ETag mismatch) we get when the host was modified
+    after we fetched the ETag, eg. by moving it to another folder.
+    """
+    hostname = change['host']
+    if not has_attributes(change):
+        return True
+    try:
+        return _with_etag(cmk, hostname, retries,
+                          lambda etag: cmk.update_host_in_cmk(hostname,
+                                                              etag,
+                                                              change.get('attributes'),
+                                                              change.get('remove_attributes')))
+    except Exception as exc:
+        logger.error(f'could not update {hostname}; got exception {exc}')
+        return False
+
+def bulk_update(cmk, batch):
+    """update attributes of a batch of hosts using a single request
+
+    cmk does not allow to update and remove attributes in the same entry.
+    Hosts that have attributes to be removed get a second entry.
+    """
+    entries = []
+    for change in batch:
+        if change.get('attributes'):
+            entries.append({'host_name': change['host'],
+                            'update_attributes': change['attributes']})
+    for change in batch:
+        if change.get('remove_attributes'):
+            entries.append({'host_name': change['host'],
+                            'remove_attributes': change['remove_attributes']})
+    if len(entries) == 0:
+        return True
+
+    logger.debug(f'sending bulk update containing {len(entries)} entries')
+    try:
+        response = cmk.put(url='/domain-types/host_config/actions/bulk-update/invoke',
+                           json={'entries': entries})
+    except Exception as exc:
+        logger.error(f'bulk update failed; got exception {exc}')
+        return False
+    if response.status_code != 200:
+        logger.error(f'bulk update failed; got status {response.status_code} {response.content}')
+        return False
+    return True
+
+def has_attributes(change):
+    return change.get('attributes') or change.get('htg') or change.get('remove_attributes')
+
+def _with_etag(cmk, hostname, retries, call):
+    for attempt in range(retries + 1):
+        etag = cmk.get_etag(hostname)
+        if call(etag):
+            return True
+        if attempt < retries:
+            logger.debug(f'update of {hostname} failed; retrying with new ETag ({attempt + 1}/{retries})')
+    logger.error(f'could not update {hostname} after {retries + 1} attempts')
+    return False
@@ -0,0 +1,64 @@
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+from loguru import logger
+
+
+class Watermark:
+    """state of the last sync used by the incremental mode
+
+    The watermark contains the time of the last sync, a fingerprint of
+    the settings used to compute the SOT config of the hosts and, for
+    each host, the last_updated timestamp of the SOT and a fingerprint of
+    the computed SOT config. A host has to be synced again if one of them
+    has changed.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.last_sync = None
+        self.settings = None
+        self.hosts = {}
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.filename):
+            logger.info(f'watermark {self.filename} not found; all hosts are synced')
+            return
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except Exception as exc:
+            logger.error(f'could not read watermark {self.filename}; got exception {exc}')
+            return
+        self.last_sync = data.get('last_sync')
+        self.settings = data.get('settings')
+        self.hosts = data.get('hosts', {})
+        logger.debug(f'read watermark of {len(self.hosts)} hosts; last sync {self.last_sync}')
+
+    def save(self):
+        self.last_sync = datetime.now(timezone.utc).isoformat()
+        tmp_filename = f'{self.filename}.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump({'last_sync': self.last_sync, 'settings': self.settings, 'hosts': self.hosts}, f)
+        os.replace(tmp_filename, self.filename)
+        logger.debug(f'wrote watermark of {len(self.hosts)} hosts to {self.filename}')
+
+    def has_changed(self, hostname, last_updated, fingerprint=None):
+        """return True if the host has changed; the fingerprint is only compared if it is set"""
+        host = self.hosts.get(hostname)
+        if host is None:
+            return True
+        if host.get('last_updated') != last_updated:
+            return True
+        return fingerprint is not None and host.get('fingerprint') != fingerprint
+
+    def update(self, hostname, last_updated, fingerprint):
+        self.hosts[hostname] = {'last_updated': last_updated, 'fingerprint': fingerprint}
+
+
+def fingerprint(sot_config):
+    """return fingerprint of the computed SOT config of a host"""
+    data = json.dumps(sot_config, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()